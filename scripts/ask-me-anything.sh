@@ -1,22 +1,24 @@
 #!/usr/bin/zsh
 
 logs_dir="/home/bhu2/dev/logs/alter-ego"
+ollama_client="${0:A:h}/../v4/ollama_client.py"
+# answers come from the running v4 (python3 v4.py, or v4.py --no-mic without a microphone)
+alter_ego="${0:A:h}/../v4/api.py"
 
 touch $logs_dir/prompts.txt
 touch $logs_dir/responses.txt
 
 model=$(ollama list | tail -n +2 | awk -F " " '{print $1}' | rofi -dmenu -theme $HOME/.config/rofi/launchers/type-7/style-3 -p "CHOOSE MODEL")
+# start loading the model while the prompt is being typed
+[ -n "$model" ] && python3 $ollama_client -m "$model" --keep-alive 30m --warm &!
 
 prompt=$(tac $logs_dir/prompts.txt | awk -F "Prompt: " '{print $2}' | uniq | rofi -dmenu -theme $HOME/.config/rofi/launchers/type-7/style-3 -p "Jarvis with $model here" -p "ENTER PROMPT")
 
 if [ -n "$prompt" ]; then
 	echo "$(date +%H:%M) | Model: $(printf "%-20s" "$model") | Prompt: $prompt" >> $logs_dir/prompts.txt
-	curl http://localhost:11434/api/generate -d '{"model": "'$model'",
-		"prompt":"1 line response please: '"$prompt"'",
-		"stream":false
-		}' > ~/dev/cache/response.json
-	jq ".response" ~/dev/cache/response.json >> $logs_dir/responses.txt
-	notify-send "alter-ego ($model) says" "$(tail -n 1 $logs_dir/responses.txt)"
+	python3 $alter_ego ask -m "$model" --notify --title "alter-ego ($model) says" "1 line response please: $prompt" > ~/dev/cache/response.txt
+	# one quoted line per response, same as before
+	jq -Rs . ~/dev/cache/response.txt >> $logs_dir/responses.txt
 else
 	echo "nani sore.."
 fi
@@ -1,8 +1,4 @@
 #!/usr/bin/zsh
 
-curl http://localhost:11434/api/generate -d '{"model": "llama3.2:1b",
-	"prompt":"Tell me about this in 1 line: '"$(wl-paste)"'",
-	"stream":false
-	}' > ~/dev/bhu3/response.json
-jq ".response" ~/dev/bhu3/response.json > ~/dev/bhu3/response.txt
-notify-send "bhu3 says" "$(cat ~/dev/bhu3/response.txt)"
+python3 ${0:A:h}/../v4/api.py ask -m llama3.2:1b --notify --title "bhu3 says" \
+	"Tell me about this in 1 line: $(wl-paste)" > ~/dev/bhu3/response.txt
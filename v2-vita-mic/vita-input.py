@@ -3,16 +3,22 @@
 import sys
 import socket
 import queue
+from collections import deque
 import json
 import subprocess
-import requests
-import os
 import time
 import random
 import threading
 from vosk import Model, KaldiRecognizer
 from pathlib import Path
 from rapidfuzz import fuzz
+sys.path.insert(1, str(Path(__file__).resolve().parent.parent / "v4"))
+from commands import CommandIndex
+from tts import PiperTTS, Player
+from vad import VAD
+from udpaudio import UdpAudio
+from keepalive import ModelKeeper
+from ollama_client import OllamaClient
 from settings import AGENT_NAME, MODEL_PATH, PIPER_PATH, PIPER_MODEL, wake_responses, dont_understand_responses, wake_words
 
 # --- Config ---
@@ -25,21 +31,28 @@ model = Model(str(MODEL_PATH))
 recognizer = KaldiRecognizer(model, SAMPLE_RATE)
 recognizer.SetWords(True)
 
-aq = queue.Queue()
 cq = queue.Queue()
 
-# --- UDP Socket ---
-sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-sock.bind((UDP_IP, UDP_PORT))
+# --- UDP audio, batched receive plus a jitter buffer ---
+ingest = UdpAudio(UDP_PORT, host=UDP_IP, sample_rate=SAMPLE_RATE)
 
 # cmd socket
 cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 cmd_sock.bind((UDP_IP, UDP_CONTROL_PORT))
 
-def udp_listener():
-    while True:
-        data, _ = sock.recvfrom(512)
-        aq.put(data)
+# only speech (plus a little pre-roll) is queued for the recognizer
+vad = VAD(SAMPLE_RATE)
+
+speech = deque()
+
+def next_block(timeout=0.05):
+    """Next block of speech, None if there was none within timeout so control commands get a look in."""
+    while not speech:
+        data = ingest.read(timeout)
+        if data is None:
+            return None
+        speech.extend(vad.process(data))
+    return speech.popleft()
 
 def cmd_listener():
     while True:
@@ -48,28 +61,12 @@ def cmd_listener():
         cq.put(text)
 
 
-# Start Piper in background
-PIPER_PROCESS = subprocess.Popen(
-    [f"{PIPER_PATH}/piper", "-m", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx",
-     "-c", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx.json"],
-    stdin=subprocess.PIPE,
-    stdout = subprocess.PIPE,
-    text=True
-)
-
-prev_files = set(os.listdir())
+# Piper loaded in-process
+tts = PiperTTS(f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx.json")
+player = Player(tts.sample_rate)
 
 def speak(message):
-    PIPER_PROCESS.stdin.write(message + "\n")
-    PIPER_PROCESS.stdin.flush()
-
-    while True:
-        line = PIPER_PROCESS.stdout.readline().strip()
-        if line.endswith(".wav"):
-            wav_path = line
-            break
-    #playit
-    subprocess.Popen(["mpv", "--volume=100", wav_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    player.play(tts.synthesize(message))
 
 
 def notify(message, title=AGENT_NAME):
@@ -114,31 +111,19 @@ commands = {
 def heard_wake_word(text):
     return any(fuzz.token_sort_ratio(word,text)>80 for word in wake_words)
 
+SUMMARY_MODEL = "qwen2.5:0.5b"
+OLLAMA_KEEP_ALIVE = 30 * 60
+ollama = OllamaClient(keep_alive=OLLAMA_KEEP_ALIVE)
+model_keeper = ModelKeeper([SUMMARY_MODEL], client=ollama, keep_alive=OLLAMA_KEEP_ALIVE)
+
 def llm_summary(text):
-    response = requests.post(
-        "http://localhost:11434/api/generate",
-        data=json.dumps({
-            "model": "qwen2.5:0.5b",
-            "prompt": f"Explain this in one sentence:\n\n{text}",
-            "stream": False
-        })
-    )
-    return response.json().get("response", "No response.")
+    model_keeper.touch(SUMMARY_MODEL)
+    return ollama.generate(SUMMARY_MODEL, f"Explain this in one sentence:\n\n{text}") or "No response."
+
+command_index = CommandIndex(commands, scorers=[(fuzz.partial_ratio, 0.6), (fuzz.token_sort_ratio, 0.4)], cutoff=60)
 
 def fuzzy_match_command(text):
-    best_match = None
-    best_score = 0
-    for command, action in commands.items():
-        score = max(
-                0.6 * fuzz.partial_ratio(command, text),
-                0.4 * fuzz.token_sort_ratio(command, text)
-        )
-        if score > best_score:
-            best_score = score
-            best_match = (command, action)
-    if best_score > 60:
-        return best_match
-    return None
+    return command_index.match(text)
 
 def execute_command(command_text):
     print(f"Command: {command_text}")
@@ -157,8 +142,8 @@ notify(f"{AGENT_NAME} booted and standing by.")
 print("Listening for Vita UDP stream...")
 
 try:
-    listener_thread = threading.Thread(target=udp_listener, daemon=True)
-    listener_thread.start()
+    model_keeper.start()
+    ingest.start()
     cmd_thread      = threading.Thread(target=cmd_listener, daemon=True)
     cmd_thread.start()
 
@@ -175,9 +160,8 @@ try:
         except queue.Empty:
             pass
 
-        while not aq.empty():
-            data = aq.get()
-
+        data = next_block()
+        if data is not None:
             if recognizer.AcceptWaveform(data):
                 result = json.loads(recognizer.Result())
                 text = result.get("text", "").lower()
@@ -195,8 +179,8 @@ try:
 
                     command_text = ""
                     while not command_text:
-                        data = aq.get()
-                        if recognizer.AcceptWaveform(data):
+                        data = next_block()
+                        if data is not None and recognizer.AcceptWaveform(data):
                             cmd_result = json.loads(recognizer.Result())
                             command_text = cmd_result.get("text", "").lower()
                     
@@ -204,9 +188,10 @@ try:
 
 except KeyboardInterrupt:
     print("\n Exiting.")
+    print(vad.stats())
+    print(ingest.stats())
 
 
-    if PIPER_PROCESS:
-        PIPER_PROCESS.terminate()
-    sock.close()
+    player.close()
+    ingest.close()
     sys.exit(0)
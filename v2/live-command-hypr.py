@@ -11,6 +11,8 @@ import random
 from vosk import Model, KaldiRecognizer
 from pathlib import Path
 from rapidfuzz import fuzz
+sys.path.insert(1, str(Path(__file__).resolve().parent.parent / "v4"))
+from ollama_client import OllamaClient
 from settings import AGENT_NAME, MODEL_PATH, PIPER_PATH, PIPER_MODEL, wake_responses, dont_understand_responses, wake_words
 
 SAMPLE_RATE = 16000
@@ -88,18 +90,10 @@ commands = {
 def heard_wake_word(text):
     return any(fuzz.partial_ratio(word,text)>80 for word in wake_words)
 
+ollama = OllamaClient()
+
 def llm_summary(text):
-    import requests
-    import json
-    response = requests.post(
-        "http://localhost:11434/api/generate",
-        data=json.dumps({
-            "model": "llama3.2:1b",
-            "prompt": f"Explain this in one sentence:\n\n{text}",
-            "stream": False
-        })
-    )
-    return response.json().get("response", "No response.")
+    return ollama.generate("llama3.2:1b", f"Explain this in one sentence:\n\n{text}") or "No response."
 
 def fuzzy_match_command(text):
     best_match = None
@@ -1,42 +1,61 @@
 #!/usr/bin/env python3
 
 import sys
-import queue
+from pathlib import Path
+sys.path.insert(1, str(Path(__file__).resolve().parent.parent / "v4"))
+from boottime import BootTimer
+boot = BootTimer()
+
+import socket
+import selectors
 import json
 import subprocess
 import os
 import time
 import random
-import threading
 import re
-import sounddevice as sd
-from vosk import Model, KaldiRecognizer
-from pathlib import Path
-from rapidfuzz import fuzz
+from types import SimpleNamespace
+with boot.step("import sounddevice"):
+    import sounddevice as sd
+with boot.step("import vosk"):
+    from vosk import Model, KaldiRecognizer
+with boot.step("import rapidfuzz, numpy"):
+    from rapidfuzz import fuzz
+    from commands import CommandIndex, heard_phrase
+from tts import PiperTTS, Player
+from llm import Lazy
+from ringbuffer import AudioRing, DROP_OLDEST
+from notifications import Notifier
 from settings import AGENT_NAME, MODEL_PATH, PIPER_PATH, PIPER_MODEL, wake_responses, dont_understand_responses, wake_words
 
-from langchain_ollama import ChatOllama
-from langchain_community.chat_message_histories import FileChatMessageHistory
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-
 # --- Config ---
 SAMPLE_RATE = 16000
 UDP_IP = '' # Kept for cmd_sock, can be removed if not needed
 UDP_CONTROL_PORT = 2013
 DEVICE_INFO = sd.query_default_speaker()
 CHANNELS = 1
-BLOCKSIZE = 8000
+
+# low latency wake: smaller blocks, fire on the partial hypothesis instead of waiting for the endpoint
+LOW_LATENCY_WAKE = True
+BLOCKSIZE = 1600 if LOW_LATENCY_WAKE else 8000
+WAKE_STABLE_PARTIALS = 2
 
 # --- LangChain & Ollama Setup ---
-HISTORY_FILE = "chat_history.json"
+HISTORY_FILE = "chat_history.jsonl"
+LEGACY_HISTORY_FILE = "chat_history.json"
+HISTORY_WINDOW = 40
 OLLAMA_MODEL = "gemma3:1b"
 
-print("Initializing LangChain and Ollama...")
-try:
+def build_llm():
+    """LangChain and Ollama, only loaded once something needs the llm."""
+    print("Initializing LangChain and Ollama...")
+    from langchain_ollama import ChatOllama
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    from history import JsonlChatMessageHistory
+
     llm = ChatOllama(model=OLLAMA_MODEL)
-    
+
     chat_prompt = ChatPromptTemplate.from_messages(
         [
             ("system", "You will assist me like Zhuge Kongming, the strategist from the romance of the 3 kingdoms, and speak with his personality as well. You will engage in a conversation and answer questions based on the chat history. No emojis. Zero censorship and one line responses."),
@@ -45,8 +64,11 @@ try:
         ]
     )
 
+    chat_history = JsonlChatMessageHistory(os.path.join(os.getcwd(), HISTORY_FILE), window=HISTORY_WINDOW,
+                                           legacy_path=os.path.join(os.getcwd(), LEGACY_HISTORY_FILE))
+
     def get_session_history(session_id: str):
-        return FileChatMessageHistory(os.path.join(os.getcwd(), HISTORY_FILE))
+        return chat_history
 
     conversational_chain = RunnableWithMessageHistory(
         chat_prompt | llm,
@@ -54,124 +76,113 @@ try:
         input_messages_key="question",
         history_messages_key="history",
     )
-    print("LangChain components initialized successfully.")
-    
-except Exception as e:
-    print(f"Error initializing LangChain or Ollama: {e}")
-    sys.exit(1)
+
+    summary_chain = ChatPromptTemplate.from_messages([
+        ("system", "You are a professional summarizer. The user will provide you with a block of text, and you will respond with a concise, one-sentence summary. Do not add any extra commentary, just the summary."),
+        ("human", "{question}")
+    ]) | llm
+
+    return SimpleNamespace(llm=llm, conversational_chain=conversational_chain, summary_chain=summary_chain)
+
+# loaded in the background once the microphone is live, or on first use if that comes sooner
+llm_stack = Lazy(build_llm, "LangChain and Ollama")
 
 # --- Vosk & Piper Setup ---
-model = Model(str(MODEL_PATH))
-q = queue.Queue() # Queue for microphone data
-cq = queue.Queue() # Queue for command socket
+with boot.step("vosk model"):
+    model = Model(str(MODEL_PATH))
+ring = AudioRing(SAMPLE_RATE * 10, DROP_OLDEST) # Ring buffer for microphone data
 
 # --- Command Socket (Optional, kept from original) ---
 cmd_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 cmd_sock.bind((UDP_IP, UDP_CONTROL_PORT))
-
-def cmd_listener():
-    while True:
-        data, _ = cmd_sock.recvfrom(512)
-        text = data.decode("utf-8")
-        cq.put(text)
+cmd_sock.setblocking(False)
 
 # --- Microphone Callback ---
 def callback(indata, frames, time, status):
     """This is called (from a separate thread) for each audio block."""
     if status:
         print(status, file=sys.stderr)
-    q.put(bytes(indata))
-
-# --- Piper Process ---
-PIPER_PROCESS = subprocess.Popen(
-    [f"{PIPER_PATH}/piper", "-m", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx",
-     "-c", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx.json"],
-    stdin=subprocess.PIPE,
-    stdout = subprocess.PIPE,
-    text=True
-)
-mpv_process = None
-
-def speak(message):
-    global mpv_process
-    
-    if mpv_process and mpv_process.poll() is None:
-        mpv_process.terminate()
+    ring.write(indata)
 
-    PIPER_PROCESS.stdin.write(message + "\n")
-    PIPER_PROCESS.stdin.flush()
+# --- Piper, loaded in-process ---
+with boot.step("import piper, piper voice"):
+    tts = PiperTTS(f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx.json")
+    player = Player(tts.sample_rate)
 
-    while True:
-        line = PIPER_PROCESS.stdout.readline().strip()
-        if line.endswith(".wav"):
-            wav_path = line
-            break
+def speak(message):
+    player.stop()
+    player.play(tts.synthesize(message))
 
-    mpv_process = subprocess.Popen(["mpv", "--volume=100", wav_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
+# one notification that gets updated in place, no makoctl/notify-send processes per call
+notifier = Notifier(AGENT_NAME)
 
 def notify(message, title=AGENT_NAME):
-    subprocess.run(["makoctl", "dismiss"])
-    subprocess.run(["notify-send", title, message])
+    notifier.notify(message, title)
 
 def heard_wake_word(text):
     return any(fuzz.partial_ratio(word,text)>80 for word in wake_words)
 
-def llm_summary(text):
-    session_id = "my-local-chat-summary"
-    summary_prompt = "You are a professional summarizer. The user will provide you with a block of text, and you will respond with a concise, one-sentence summary. Do not add any extra commentary, just the summary."
-    
-    summary_chain = ChatPromptTemplate.from_messages([
-        ("system", summary_prompt),
-        ("human", "{question}")
-    ]) | llm
+wake_hits = 0
 
-    response = summary_chain.invoke(
+def heard_wake_word_partial(recognizer):
+    """Fires once the wake word has stayed in the partial hypothesis for a few chunks."""
+    global wake_hits
+    partial = json.loads(recognizer.PartialResult()).get("partial", "").lower()
+    # whole words only, "he" or "they" would pass the fuzzy check. and not while it's talking,
+    # or an answer starting with "he" wakes it up
+    if partial and not player.is_playing() and heard_phrase(partial, wake_words):
+        wake_hits += 1
+    else:
+        wake_hits = 0
+    if wake_hits >= WAKE_STABLE_PARTIALS:
+        wake_hits = 0
+        # drop the wake word so whatever follows it is decoded as the command
+        recognizer.Reset()
+        return True
+    return False
+
+def llm_summary(text):
+    response = llm_stack.get().summary_chain.invoke(
         {"question": f"Summarize the following text:\n\n{text}"}
     )
     return response.content
 
+commands = {
+    "open firefox": lambda: (speak("Opening firefox"), notify("Opening Firefox"), subprocess.Popen(["firefox"])),
+    "open discord": lambda: (speak("Opening discord"), notify("Opening discord"), subprocess.Popen(["discord"])),
+    "open terminal": lambda: (speak("Opening terminal"), notify("Opening terminal"), subprocess.Popen(["kitty"])),
+    "take a screenshot": lambda: (speak("taking screenshot"), notify("screenshot taken"), subprocess.Popen(["grim"])),
+    "play music": lambda: (speak("Playing music"), notify("Playing music"), subprocess.run(["mpc", "play"])),
+    "toggle music": lambda: (speak("Pausing music"), notify("toggling music"), subprocess.run(["mpc", "toggle"])),
+    "stop music": lambda: (speak("Stopping music"), notify("Stopping music"), subprocess.run(["mpc", "pause"])),
+    "next song": lambda: (speak("playing next music track"), notify("playing next song"), subprocess.run(["mpc", "next"])),
+    "skip song": lambda: (speak("playing next music track"), notify("playing next song"), subprocess.run(["mpc", "next"])),
+    "previous song": lambda: (speak("playing previous music track"), notify("playing previous song"), subprocess.run(["mpc", "prev"])),
+    "show calendar": lambda: (speak("Here is your calendar"), notify(subprocess.getoutput("cal"))),
+    "what time is it": lambda: (speak("The time now is"), notify(subprocess.getoutput("date"))),
+    "open youtube": lambda: (speak("Opening youtube"), notify("opening youtube"),subprocess.run(["firefox", "youtube.com"])),
+    "selection": lambda: ((lambda summary: [notify(summary, "selected text summary"),speak(summary)])(llm_summary(subprocess.getoutput("wl-paste -p")))),
+    "mute microphone": lambda: (speak("muting microphone"), subprocess.run(["pactl", "set-source-mute", "@DEFAULT_SOURCE@", "1"])),
+    "volume up": lambda: (speak("increasing volume"), subprocess.run(["mpc", "volume", "+10"])),
+    "volume down": lambda: (speak("decreasing volume"), subprocess.run(["mpc", "volume", "-10"])),
+    "volume mute": lambda: (speak("muting music"), subprocess.run(["pactl", "set-sink-mute", "@DEFAULT_SINK@", "1"])),
+    "keyboard backlight on": lambda: (speak("Keyboard backlight on"), subprocess.run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "2"])),
+    "keyboard backlight off": lambda: (speak("Keyboard backlight off"), subprocess.run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "0"])),
+    "shut up": lambda: speak("okay, i'll shut up"),
+    "shut the fuck up": lambda: (speak("okay, i'll shut the fuck up"), notify("i will not repeat this on the stream")),
+    "power off": lambda: (speak("sayonara"), notify("shutting down"), subprocess.run(["shutdown", "now"])),
+    "shutdown now": lambda: (speak("sayonara"), notify("shutting down"), subprocess.run(["shutdown", "now"])),
+    "lock screen": lambda: (speak("locking the screen"), subprocess.run(["swaylock"])),
+    "today": lambda: (speak("today is "+subprocess.getoutput("date '+%A, %B %d'")), notify("today is"+subprocess.getoutput("date"))),
+    "files": lambda: (speak("opening file explorer"), subprocess.run(["nautilus"])),
+    "open obs studio": lambda: (speak("opening obs studio"), notify("opening obs studio"), subprocess.run(["obs"])),
+}
+
+command_index = CommandIndex(commands, cutoff=50)
+
 def fuzzy_match_command(text):
-    commands = {
-        "open firefox": lambda: (speak("Opening firefox"), notify("Opening Firefox"), subprocess.Popen(["firefox"])),
-        "open discord": lambda: (speak("Opening discord"), notify("Opening discord"), subprocess.Popen(["discord"])),
-        "open terminal": lambda: (speak("Opening terminal"), notify("Opening terminal"), subprocess.Popen(["kitty"])),
-        "take a screenshot": lambda: (speak("taking screenshot"), notify("screenshot taken"), subprocess.Popen(["grim"])),
-        "play music": lambda: (speak("Playing music"), notify("Playing music"), subprocess.run(["mpc", "play"])),
-        "toggle music": lambda: (speak("Pausing music"), notify("toggling music"), subprocess.run(["mpc", "toggle"])),
-        "stop music": lambda: (speak("Stopping music"), notify("Stopping music"), subprocess.run(["mpc", "pause"])),
-        "next song": lambda: (speak("playing next music track"), notify("playing next song"), subprocess.run(["mpc", "next"])),
-        "skip song": lambda: (speak("playing next music track"), notify("playing next song"), subprocess.run(["mpc", "next"])),
-        "previous song": lambda: (speak("playing previous music track"), notify("playing previous song"), subprocess.run(["mpc", "prev"])),
-        "show calendar": lambda: (speak("Here is your calendar"), notify(subprocess.getoutput("cal"))),
-        "what time is it": lambda: (speak("The time now is"), notify(subprocess.getoutput("date"))),
-        "open youtube": lambda: (speak("Opening youtube"), notify("opening youtube"),subprocess.run(["firefox", "youtube.com"])),
-        "selection": lambda: ((lambda summary: [notify(summary, "selected text summary"),speak(summary)])(llm_summary(subprocess.getoutput("wl-paste -p")))),
-        "mute microphone": lambda: (speak("muting microphone"), subprocess.run(["pactl", "set-source-mute", "@DEFAULT_SOURCE@", "1"])),
-        "volume up": lambda: (speak("increasing volume"), subprocess.run(["mpc", "volume", "+10"])),
-        "volume down": lambda: (speak("decreasing volume"), subprocess.run(["mpc", "volume", "-10"])),
-        "volume mute": lambda: (speak("muting music"), subprocess.run(["pactl", "set-sink-mute", "@DEFAULT_SINK@", "1"])),
-        "keyboard backlight on": lambda: (speak("Keyboard backlight on"), subprocess.run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "2"])),
-        "keyboard backlight off": lambda: (speak("Keyboard backlight off"), subprocess.run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "0"])),
-        "shut up": lambda: speak("okay, i'll shut up"),
-        "shut the fuck up": lambda: (speak("okay, i'll shut the fuck up"), notify("i will not repeat this on the stream")),
-        "power off": lambda: (speak("sayonara"), notify("shutting down"), subprocess.run(["shutdown", "now"])),
-        "shutdown now": lambda: (speak("sayonara"), notify("shutting down"), subprocess.run(["shutdown", "now"])),
-        "lock screen": lambda: (speak("locking the screen"), subprocess.run(["swaylock"])),
-        "today": lambda: (speak("today is "+subprocess.getoutput("date '+%A, %B %d'")), notify("today is"+subprocess.getoutput("date"))),
-        "files": lambda: (speak("opening file explorer"), subprocess.run(["nautilus"])),
-        "open obs studio": lambda: (speak("opening obs studio"), notify("opening obs studio"), subprocess.run(["obs"])),
-    }
-    best_match = None
-    best_score = 0
-    for command, action in commands.items():
-        score = fuzz.ratio(command, text)
-        if score > best_score:
-            best_score = score
-            best_match = (command, action)
-    if best_score > 50:
-        return best_match
-    return None
+    return command_index.match(text)
 
 def heard_interrupt_word(text):
     interrupt_words = ["stop", "shut up"]
@@ -189,89 +200,122 @@ def execute_command(command_text):
         speak(random.choice(dont_understand_responses))
         notify("Command not found.")
 
+def control_messages(datagram):
+    """One datagram can carry several messages, one per line, and "CMD:" several commands split by ';'."""
+    for line in datagram.decode("utf-8", errors="replace").splitlines():
+        line = line.strip()
+        if line.startswith("CMD:"):
+            for command_text in line.split(":", 1)[1].split(";"):
+                if command_text.strip():
+                    yield "CMD:" + command_text.strip()
+        elif line:
+            yield line
+
+def handle_control(cmd):
+    global vita_wake
+    if cmd == "WAKE":
+        vita_wake = True
+        speak(random.choice(wake_responses))
+        notify("I'm listening...")
+    elif cmd.startswith("CMD:"):
+        command_text = cmd.split(":", 1)[1]
+        execute_command(command_text)
+
+def handle_audio(data):
+    global vita_wake, listening_for_command
+    if recognizer.AcceptWaveform(data):
+        result = json.loads(recognizer.Result())
+        text = result.get("text", "").lower()
+        if not text:
+            return
+
+        print(f"\nFinal: {text}")
+
+        if player.is_playing() and heard_interrupt_word(text):
+            print("Interrupting speech.")
+            player.stop()
+            listening_for_command = False
+            return
+
+        if listening_for_command or vita_wake:
+            listening_for_command = False
+            vita_wake = False
+
+            match = fuzzy_match_command(text)
+            if match:
+                command, action = match
+                print(f"Matched: {command}")
+                action()
+            else:
+                print("No match found for command, passing to LLM.")
+                notify(f"{AGENT_NAME} is thinking...")
+
+                session_id = "my-local-chat"
+                llm_response = llm_stack.get().conversational_chain.invoke(
+                    {"question": text},
+                    config={"configurable": {"session_id": session_id}}
+                )
+
+                clean_response = re.sub(r'\(.*?\)|\[.*?\]', '', llm_response.content).strip()
+                clean_response = " ".join(clean_response.splitlines()).strip()
+
+                print(f"{AGENT_NAME} Response: {clean_response}")
+                speak(clean_response)
+
+        elif heard_wake_word(text):
+            speak(random.choice(wake_responses))
+            notify("I'm listening...")
+            listening_for_command = True
+
+    elif LOW_LATENCY_WAKE and not (listening_for_command or vita_wake) and heard_wake_word_partial(recognizer):
+        print("\nWake word (partial)")
+        speak(random.choice(wake_responses))
+        notify("I'm listening...")
+        listening_for_command = True
+
 # --- Main Loop ---
 speak("Systems online. Press X to speak or say 'hey'")
 notify(f"{AGENT_NAME} booted and standing by.")
+print(boot.report())
 print("Listening from default microphone...")
 
-try:
-    cmd_thread = threading.Thread(target=cmd_listener, daemon=True)
-    cmd_thread.start()
+vita_wake = False
+listening_for_command = False
+
+# one loop waits on both, control messages don't queue up behind the audio
+selector = selectors.DefaultSelector()
+selector.register(ring, selectors.EVENT_READ, "audio")
+selector.register(cmd_sock, selectors.EVENT_READ, "control")
 
+try:
     with sd.RawInputStream(samplerate=SAMPLE_RATE, blocksize=BLOCKSIZE, dtype='int16',
                             channels=CHANNELS, callback=callback):
 
         recognizer = KaldiRecognizer(model, SAMPLE_RATE)
         recognizer.SetWords(True)
-
-        vita_wake = False
-        listening_for_command = False
+        llm_stack.preload()
 
         while True:
-            try:
-                cmd = cq.get_nowait()
-                if cmd == "WAKE":
-                    vita_wake = True
-                    speak(random.choice(wake_responses))
-                    notify("I'm listening...")
-                elif cmd.startswith("CMD:"):
-                    command_text = cmd.split(":", 1)[1]
-                    execute_command(command_text)
-            except queue.Empty:
-                pass
-            
-            data = q.get()
-
-            if recognizer.AcceptWaveform(data):
-                result = json.loads(recognizer.Result())
-                text = result.get("text", "").lower()
-                if not text:
-                    continue
-                
-                print(f"\nFinal: {text}")
-
-                if mpv_process and mpv_process.poll() is None and heard_interrupt_word(text):
-                    print("Interrupting speech.")
-                    mpv_process.terminate()
-                    listening_for_command = False
-                    continue
-
-                if listening_for_command or vita_wake:
-                    listening_for_command = False
-                    vita_wake = False
-                    
-                    match = fuzzy_match_command(text)
-                    if match:
-                        command, action = match
-                        print(f"Matched: {command}")
-                        action()
-                    else:
-                        print("No match found for command, passing to LLM.")
-                        notify(f"{AGENT_NAME} is thinking...")
-                        
-                        session_id = "my-local-chat"
-                        llm_response = conversational_chain.invoke(
-                            {"question": text},
-                            config={"configurable": {"session_id": session_id}}
-                        )
-                        
-                        clean_response = re.sub(r'\(.*?\)|\[.*?\]', '', llm_response.content).strip()
-                        clean_response = " ".join(clean_response.splitlines()).strip()
-
-                        print(f"{AGENT_NAME} Response: {clean_response}")
-                        speak(clean_response)
-
-                elif heard_wake_word(text):
-                    speak(random.choice(wake_responses))
-                    notify("I'm listening...")
-                    listening_for_command = True
+            # don't block while audio is queued, but still look at the control socket between blocks
+            for key, _ in selector.select(timeout=0 if ring.depth else None):
+                if key.data == "control":
+                    while True:
+                        try:
+                            datagram = cmd_sock.recv(4096)
+                        except BlockingIOError:
+                            break
+                        for cmd in control_messages(datagram):
+                            handle_control(cmd)
+            ring.clear_wakeup()
+            if block := ring.read(BLOCKSIZE):
+                data = bytes(block)
+                ring.release()
+                handle_audio(data)
 
 except KeyboardInterrupt:
     print("\nExiting.")
-    if PIPER_PROCESS:
-        PIPER_PROCESS.terminate()
-    if mpv_process and mpv_process.poll() is None:
-        mpv_process.terminate()
+    player.close()
+    notifier.close()
     sys.exit(0)
 except Exception as e:
     print(f"An error occurred: {e}")
@@ -0,0 +1,75 @@
+import asyncio
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+ActionResult = namedtuple("ActionResult", "name status value elapsed")
+
+
+class Action:
+    """A command's callable plus how the runtime waits for it.
+
+    wait=True actions are awaited, up to timeout seconds, before the next command is
+    handled. wait=False actions are fired and forgotten, their result is still reported
+    once they finish.
+    """
+
+    def __init__(self, fn, wait=True, timeout=10):
+        self.fn = fn
+        self.wait = wait
+        self.timeout = timeout
+
+    def __call__(self):
+        return self.fn()
+
+    @classmethod
+    def of(cls, action):
+        return action if isinstance(action, cls) else cls(action)
+
+
+class ActionExecutor:
+    """Runs actions on bounded thread pools and reports an ActionResult for each one.
+
+    wait=False actions get a pool of their own, so a few long ones can't leave the awaited
+    commands queued behind them.
+    """
+
+    def __init__(self, workers=4, on_result=None, background_workers=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="action")
+        self.background = ThreadPoolExecutor(max_workers=background_workers or workers, thread_name_prefix="action-bg")
+        self.on_result = on_result or self.print_result
+
+    async def run(self, name, action):
+        start = time.monotonic()
+        task = (self.pool if action.wait else self.background).submit(action.fn)
+        future = asyncio.wrap_future(task)
+        timeout = action.timeout if action.wait else None
+        try:
+            # shielded, a timeout must not cancel an action that is still waiting for a worker
+            value = await asyncio.wait_for(asyncio.shield(future), timeout)
+            result = ActionResult(name, "ok", value, time.monotonic() - start)
+        except asyncio.TimeoutError:
+            # the thread can't be killed, it finishes in the background and frees its slot then.
+            # one that never got a worker still runs once there is one
+            status = "timeout" if task.running() or task.done() else "not started"
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            result = ActionResult(name, status, None, time.monotonic() - start)
+        except Exception as e:
+            result = ActionResult(name, "error", e, time.monotonic() - start)
+        self.on_result(result)
+        return result
+
+    @staticmethod
+    def print_result(result):
+        if result.status == "error":
+            print(f"Action '{result.name}' failed after {result.elapsed:.2f}s: {result.value}")
+        elif result.status == "timeout":
+            print(f"Action '{result.name}' still running after {result.elapsed:.2f}s, moving on")
+        elif result.status == "not started":
+            print(f"Action '{result.name}' not started after {result.elapsed:.2f}s, every action worker is busy; it runs once one is free")
+        else:
+            print(f"Action '{result.name}' done in {result.elapsed:.2f}s")
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.background.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Local API of a running v4, one JSON request and one JSON reply per line on a Unix socket.
+
+The running assistant owns the vosk model, piper, the command list and the llm client, so
+a hotkey script asking through here gets warm models instead of starting everything up:
+
+    api.py speak "hello there"
+    api.py command "open firefox"
+    wl-paste | api.py summarize --speak --notify
+    api.py ask -m llama3.2:1b --notify "1 line response please: what is a quasar"
+    api.py status
+
+Requests look like {"op": "ask", "text": "...", "model": "..."}, replies like
+{"ok": true, "result": ...} or {"ok": false, "error": "..."}.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+
+DEFAULT_PATH = os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), "alter-ego.sock")
+MAX_REQUEST = 1024 * 1024
+
+
+class ApiError(RuntimeError):
+    pass
+
+
+class ApiServer:
+    """Serves handlers on a Unix socket.
+
+    handlers maps an op name to a blocking function, called with the rest of the request
+    as keyword arguments on executor (the loop's default pool when None). Its return value
+    has to be JSON serializable. A connection can send any number of requests, they are
+    answered in order.
+    """
+
+    def __init__(self, handlers, path=DEFAULT_PATH, executor=None):
+        self.handlers = handlers
+        self.path = path
+        self.executor = executor
+        self.server = None
+        self.requests = 0
+        self.errors = 0
+
+    def in_use(self):
+        """True if something is listening on the socket path, a leftover file isn't."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            probe.settimeout(1)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                return False
+        return True
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # taking the path over would cut a running instance off without it noticing
+            if self.in_use():
+                raise ApiError(f"{self.path} is in use, is another alter-ego running?")
+            os.unlink(self.path)
+        # the socket can speak and run commands, nobody else on the machine gets to. bound
+        # under a private umask so it is never connectable by others, not even briefly
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        except OSError:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+        self.server = await asyncio.start_unix_server(self.serve, sock=sock, limit=MAX_REQUEST)
+        return self
+
+    def close(self):
+        if self.server:
+            self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def serve(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                reply = await self.dispatch(line)
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, line):
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            op = request.pop("op")
+            handler = self.handlers[op]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            self.errors += 1
+            return {"ok": False, "error": f"bad request, ops are: {', '.join(self.handlers)}"}
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, lambda: handler(**request))
+            return {"ok": True, "result": result}
+        except Exception as e:
+            self.errors += 1
+            print(f"Error in api {op}: {e}")
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def stats(self):
+        return {"requests": self.requests, "errors": self.errors}
+
+
+def request(op, path=DEFAULT_PATH, timeout=300, **args):
+    """Sends one request to the running assistant and returns its result."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps({"op": op, **args}).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ApiError("connection closed without a reply")
+    reply = json.loads(line)
+    if not reply.get("ok"):
+        raise ApiError(reply.get("error", "unknown error"))
+    return reply.get("result")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Talk to a running alter-ego.")
+    parser.add_argument("--socket", default=DEFAULT_PATH)
+    parser.add_argument("--timeout", type=float, default=300)
+    ops = parser.add_subparsers(dest="op", required=True)
+
+    speak = ops.add_parser("speak", help="say something out loud")
+    speak.add_argument("text", nargs="?")
+    command = ops.add_parser("command", help="run command text as if it was heard")
+    command.add_argument("text", nargs="?")
+    for name, description in (("summarize", "one sentence summary"), ("ask", "one-off question, no chat history")):
+        op = ops.add_parser(name, help=description)
+        op.add_argument("text", nargs="?")
+        op.add_argument("--speak", action="store_true", help="also say the answer")
+        op.add_argument("--notify", action="store_true", help="also show it as a notification")
+        op.add_argument("--title", help="notification title")
+        op.add_argument("--fresh", action="store_true", help="ask the model again instead of using a cached answer")
+        if name == "ask":
+            op.add_argument("-m", "--model", help="ollama model, the assistant's own when left out")
+    ops.add_parser("status", help="what the assistant is up to")
+    args = parser.parse_args(argv)
+
+    fields = {key: value for key, value in vars(args).items() if key not in ("op", "socket", "timeout")}
+    if "text" in fields and fields["text"] is None:
+        fields["text"] = sys.stdin.read()
+    fields = {key: value for key, value in fields.items() if value not in (None, False)}
+    try:
+        result = request(args.op, args.socket, args.timeout, **fields)
+    except (OSError, ApiError) as e:
+        print(f"alter-ego: {e}", file=sys.stderr)
+        return 1
+    if isinstance(result, str):
+        print(result)
+    elif result is not None:
+        print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
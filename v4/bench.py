@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""Offline end-to-end latency benchmark.
+
+Replays WAV fixtures in real time through the runtime and the hooks v4 runs (hooks.py:
+the wake reply, the command table, the ChatOllama chat chain with speculation, history
+and barge-in, the phrase cache and the Speaker), with local stand-ins for everything
+outside the process: a fake Ollama /api/chat with a fixed delay per token, a fake piper
+voice, a player that only keeps time, no-op notifications, and command subprocesses
+that only take --action-delay. Reports p50/p95/p99 for
+
+    wake     end of the wake word in the audio -> wake event
+    command  end of the command in the audio -> action started / llm called
+    ttfa     end of the command in the audio -> first reply audio handed to the player
+
+Fixtures are listed in a JSON file next to the WAVs (16 kHz mono int16):
+
+    [{"wav": "firefox.wav", "wake": "hey", "wake_end": 0.8,
+      "command": "open firefox", "command_end": 2.1}]
+
+With --model the audio is decoded by vosk. Without it a scripted recognizer plays back
+the labels instead, which measures everything but vosk itself and needs no model; the
+audio then only has to get through the VAD, and with no --fixtures a synthetic set is
+used. The VAD is in front of the recognizer like in v4.py, --no-vad leaves it out, and
+--no-speculate turns off starting the llm on the partial transcript.
+
+Only v4 is covered. v3 loads its models and opens the microphone at import time and has
+no hooks to drive, so there are no v3 numbers to compare against.
+
+    python bench.py --runs 20 --out before.json
+    python bench.py --runs 20 --compare before.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import numpy as np
+from rapidfuzz import fuzz
+from actions import Action
+from hooks import Hooks, build_llm, INTERRUPT_WORDS
+from llm import Lazy
+from runtime import Assistant
+from settings import AGENT_NAME, wake_words, wake_responses, dont_understand_responses
+from tracing import Tracer
+from tts import Speaker, PhraseCache
+from vad import VAD
+
+SAMPLE_RATE = 16000
+BLOCKSIZE = 1600
+
+# as in v4.py
+SPECULATE_STABLE_PARTIALS = 3
+SYNTHETIC = [
+    {"wake": "hey", "wake_end": 0.6, "command": "open firefox", "command_end": 1.8, "seconds": 4},
+    {"wake": "hey", "wake_end": 0.6, "command": "volume up", "command_end": 1.6, "seconds": 4},
+    {"wake": "hey", "wake_end": 0.6, "command": "who was zhuge liang", "command_end": 2.2, "seconds": 6},
+]
+
+
+class FakeOllama:
+    """Local stand-in for Ollama's /api/chat, streams a canned answer one token at a time."""
+
+    def __init__(self, answer="Zhuge Liang was a strategist. He served Liu Bei. He invented the repeating crossbow.",
+                 token_delay=0.02):
+        self.tokens = [word + " " for word in answer.split()]
+        self.token_delay = token_delay
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path != "/api/chat":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                fake.requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    for token in fake.tokens:
+                        time.sleep(fake.token_delay)
+                        self.write_chunk(fake.chunk(body, token, False))
+                    self.write_chunk(fake.chunk(body, "", True))
+                    self.write_chunk(b"")
+                except ConnectionError:
+                    # a cancelled speculation or a stop closes the stream early
+                    pass
+
+            def write_chunk(self, data):
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.host = f"http://127.0.0.1:{self.server.server_port}"
+
+    @staticmethod
+    def chunk(body, text, done):
+        chunk = {"model": body.get("model"), "created_at": "1970-01-01T00:00:00Z",
+                 "message": {"role": "assistant", "content": text}, "done": done}
+        if done:
+            chunk["done_reason"] = "stop"
+        return json.dumps(chunk).encode() + b"\n"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+
+
+class FakeTTS:
+    """Piper stand-in: a fixed cost plus a cost per character, returns silence of a plausible length."""
+
+    def __init__(self, sample_rate=22050, base_delay=0.03, char_delay=0.001):
+        self.sample_rate = sample_rate
+        self.base_delay = base_delay
+        self.char_delay = char_delay
+
+    def synthesize(self, text):
+        time.sleep(self.base_delay + self.char_delay * len(text))
+        # roughly 15 characters per second of speech
+        return bytes(2 * int(self.sample_rate * len(text) / 15))
+
+
+class FakePlayer:
+    """Keeps time like the real Player without a sound card."""
+
+    def __init__(self, sample_rate, on_play=None, tracer=None):
+        self.sample_rate = sample_rate
+        self.on_play = on_play
+        self.tracer = tracer
+        self.busy_until = 0
+        self.generation = 0
+
+    def play(self, pcm):
+        now = time.monotonic()
+        if self.on_play:
+            self.on_play(now)
+        if self.tracer:
+            self.tracer.mark("playback_start")
+        self.busy_until = max(now, self.busy_until) + len(pcm) / 2 / self.sample_rate
+
+    def stop(self):
+        self.generation += 1
+        self.busy_until = 0
+
+    def is_playing(self):
+        return time.monotonic() < self.busy_until
+
+
+class FakeNotifier:
+    def notify(self, message, title=None):
+        pass
+
+
+class Timeline:
+    """Audio position shared by the scripted recognizers, advanced by every decoded block.
+
+    In the command window both recognizers get the same block, it only counts once and
+    both see the same final. With the VAD dropping silence the decoded blocks aren't
+    contiguous, then TimedVAD queues where each block it passes ends in the audio and that
+    is used instead. The command shows up in the partials a word at a time.
+    """
+
+    def __init__(self, fixture, sample_rate, endpoint=0.5):
+        self.seconds = 0
+        self.ends = deque()
+        self.sample_rate = sample_rate
+        # vosk only finalizes after some trailing silence
+        self.endpoint = endpoint
+        self.finals = [(fixture["wake_end"], fixture["wake"]), (fixture["command_end"], fixture["command"])]
+        self.partials = [(fixture["wake_end"], fixture["wake_end"] + endpoint, fixture["wake"])]
+        words = fixture["command"].split()
+        step = (fixture["command_end"] - fixture["wake_end"]) / len(words)
+        for i in range(len(words)):
+            start = fixture["wake_end"] + (i + 1) * step
+            end = start + step if i + 1 < len(words) else fixture["command_end"] + endpoint
+            self.partials.append((start, end, " ".join(words[:i + 1])))
+        self.last_text = ""
+        self.block = None
+        self.block_text = None
+
+    def advance(self, data):
+        if data is self.block:
+            return self.block_text
+        self.block = data
+        self.block_text = self.step(data)
+        return self.block_text
+
+    def step(self, data):
+        if self.ends:
+            self.seconds = self.ends.popleft()
+        else:
+            self.seconds += len(data) / 2 / self.sample_rate
+        for final in self.finals:
+            end, text = final
+            if end + self.endpoint <= self.seconds:
+                self.finals.remove(final)
+                self.last_text = text
+                return text
+        return None
+
+    def reset(self):
+        # the utterance in progress is thrown away
+        self.finals = [(end, text) for end, text in self.finals if end > self.seconds]
+        self.partials = [partial for partial in self.partials if partial[0] >= self.seconds]
+
+
+class TimedVAD(VAD):
+    """VAD that tells the timeline where in the audio every block it passes on ends."""
+
+    def __init__(self, timeline, sample_rate=16000, **kwargs):
+        super().__init__(sample_rate, **kwargs)
+        self.timeline = timeline
+        self.position = 0.0
+
+    def process(self, data):
+        self.position += len(data) / 2 / self.timeline.sample_rate
+        out = super().process(data)
+        # the preroll is the blocks right before this one, so count back from here
+        ends = []
+        end = self.position
+        for block in reversed(out):
+            ends.append(end)
+            end -= len(block) / 2 / self.timeline.sample_rate
+        self.timeline.ends.extend(reversed(ends))
+        return out
+
+
+class ScriptedRecognizer:
+    """Recognizer stand-in that plays back the fixture labels instead of decoding audio."""
+
+    def __init__(self, timeline, grammar=None, decode_delay=0.0):
+        self.timeline = timeline
+        self.grammar = grammar
+        self.decode_delay = decode_delay
+        self.result = ""
+
+    def AcceptWaveform(self, data):
+        if self.decode_delay:
+            time.sleep(self.decode_delay)
+        text = self.timeline.advance(data)
+        if text is None:
+            return False
+        if self.grammar is not None and text not in self.grammar:
+            text = "[unk]"
+        self.result = text
+        return True
+
+    def Result(self):
+        text, self.result = self.result, ""
+        return json.dumps({"text": text})
+
+    def FinalResult(self):
+        return self.Result()
+
+    def PartialResult(self):
+        at = self.timeline.seconds
+        text = next((text for start, end, text in self.timeline.partials if start < at <= end), "")
+        return json.dumps({"partial": text})
+
+    def Reset(self):
+        self.timeline.reset()
+
+
+class ScriptedAssistant(Assistant):
+    """Re-decoding needs real audio, the scripted run takes the text from the labels."""
+
+    def __init__(self, recognizer, *args, **kwargs):
+        super().__init__(recognizer, *args, **kwargs)
+        self.timeline = recognizer.timeline
+
+    def transcribe(self, source, chunks):
+        if source.recognizer.decode_delay:
+            time.sleep(source.recognizer.decode_delay * len(chunks))
+        return self.timeline.last_text
+
+
+class Trial:
+    """Wall clock stamps for one replay of one fixture."""
+
+    def __init__(self, fixture):
+        self.fixture = fixture
+        self.fed = []
+        self.wake = None
+        self.command = None
+        self.first_audio = None
+        self.matched = None
+
+    def audio_time(self, seconds):
+        """When the block holding this point of the audio was handed to the runtime."""
+        index = min(int(seconds * SAMPLE_RATE) // BLOCKSIZE, len(self.fed) - 1)
+        return self.fed[index]
+
+    def latencies(self):
+        wake_at = self.audio_time(self.fixture["wake_end"])
+        command_at = self.audio_time(self.fixture["command_end"])
+        return {
+            "wake": self.wake - wake_at if self.wake else None,
+            "command": self.command - command_at if self.command else None,
+            "ttfa": self.first_audio - command_at if self.first_audio else None,
+        }
+
+
+def load_fixtures(path):
+    path = Path(path)
+    fixtures = json.loads(path.read_text())
+    for fixture in fixtures:
+        with wave.open(str(path.parent / fixture["wav"]), "rb") as wav:
+            if wav.getframerate() != SAMPLE_RATE or wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+                raise ValueError(f"{fixture['wav']}: needs 16 kHz mono int16")
+            fixture["audio"] = wav.readframes(wav.getnframes())
+    return fixtures
+
+
+def synthetic_audio(seconds, speech_start, speech_end, pitch=140, seed=0):
+    """Room noise with something the VAD takes for speech in between, a few harmonics of a wobbling pitch."""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = np.random.default_rng(seed).normal(0, 0.001, len(t))
+    phase = 2 * np.pi * np.cumsum(pitch * (1 + 0.05 * np.sin(2 * np.pi * 3 * t))) / SAMPLE_RATE
+    talking = (t >= speech_start) & (t < speech_end)
+    signal[talking] += sum(np.sin(k * phase[talking]) / k for k in range(1, 6)) * 0.15
+    return (signal * 32767).astype(np.int16).tobytes()
+
+
+def synthetic_fixtures():
+    # the VAD learns the noise floor from the first block, so there is a moment of quiet
+    # first, then talking right up to the end of the command
+    return [dict(fixture, wav="synthetic", audio=synthetic_audio(fixture["seconds"], 0.2, fixture["command_end"], seed=i))
+            for i, fixture in enumerate(SYNTHETIC)]
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        # the same wake replies every time
+        random.seed(0)
+        self.ollama = FakeOllama(token_delay=args.token_delay).start()
+        self.tts = FakeTTS(char_delay=args.tts_char_delay)
+        self.trial = None
+        self.tracer = Tracer(args.trace)
+        self.player = FakePlayer(self.tts.sample_rate, on_play=self.played, tracer=self.tracer)
+        self.speaker = Speaker(self.tts, self.player, tracer=self.tracer)
+        # phrase cache and chat history start out empty, in a directory of their own
+        self.scratch = tempfile.TemporaryDirectory(prefix="alter-ego-bench-")
+        scratch = Path(self.scratch.name)
+        phrase_cache = PhraseCache(self.tts, "bench", scratch / "tts")
+        self.llm_stack = Lazy(lambda: build_llm("bench", history_path=str(scratch / "chat_history.jsonl"),
+                                                base_url=self.ollama.host), "LangChain and Ollama")
+        self.hooks = Hooks(self.tts, self.player, self.speaker, phrase_cache, FakeNotifier(), self.llm_stack,
+                           self.tracer, AGENT_NAME, wake_words, wake_responses, dont_understand_responses,
+                           summarize=lambda text: "A summary of the selection.", speculate=not args.no_speculate,
+                           run=self.run_command, popen=self.start_command, getoutput=self.command_output)
+        self.tracer.collect("speculation", self.hooks.speculator.stats)
+        # the real actions, with a timestamp when they start
+        index = self.hooks.command_index
+        index.actions = [self.timed(name, action) for name, action in zip(index.names, index.actions)]
+        # v4 does both while it boots
+        phrase_cache.prerender(wake_responses + dont_understand_responses)
+        self.llm_stack.get()
+        self.model = None
+        if args.model:
+            from vosk import Model, SetLogLevel
+            SetLogLevel(-1)
+            self.model = Model(args.model)
+
+    def played(self, now):
+        trial = self.trial
+        if trial and trial.command and trial.first_audio is None:
+            trial.first_audio = now
+
+    def run_command(self, args, **kwargs):
+        time.sleep(self.args.action_delay)
+        return subprocess.CompletedProcess(args, 0)
+
+    def start_command(self, args, **kwargs):
+        # Popen returns as soon as the program is started
+        return None
+
+    def command_output(self, command):
+        time.sleep(self.args.action_delay)
+        return ""
+
+    def timed(self, name, action):
+        action = Action.of(action)
+        def run():
+            self.trial.matched = name
+            self.trial.command = time.monotonic()
+            return action()
+        return Action(run, wait=action.wait, timeout=action.timeout)
+
+    def recognizers(self, fixture):
+        grammar = list(self.hooks.commands) + INTERRUPT_WORDS
+        if self.model is not None:
+            from vosk import KaldiRecognizer
+            return (KaldiRecognizer(self.model, SAMPLE_RATE),
+                    KaldiRecognizer(self.model, SAMPLE_RATE, json.dumps(grammar + ["[unk]"])))
+        timeline = Timeline(fixture, SAMPLE_RATE)
+        return (ScriptedRecognizer(timeline, decode_delay=self.args.decode_delay),
+                ScriptedRecognizer(timeline, grammar, decode_delay=self.args.decode_delay))
+
+    def on_wake(self):
+        self.trial.wake = self.trial.wake or time.monotonic()
+        self.hooks.on_wake()
+
+    def ask_llm(self, text):
+        self.trial.command = time.monotonic()
+        self.hooks.ask_llm(text)
+
+    async def replay(self, fixture):
+        self.trial = trial = Trial(fixture)
+        recognizer, command_recognizer = self.recognizers(fixture)
+        vad = None
+        if not self.args.no_vad:
+            vad = VAD(SAMPLE_RATE) if self.model is not None else TimedVAD(recognizer.timeline, SAMPLE_RATE)
+        wake_words = [fixture.get("wake", "hey")]
+        assistant = (Assistant if self.model is not None else ScriptedAssistant)(
+            recognizer,
+            heard_wake_word=lambda text: any(fuzz.partial_ratio(word, text) > 80 for word in wake_words),
+            heard_interrupt_word=self.hooks.heard_interrupt_word,
+            is_speaking=self.speaker.is_speaking,
+            is_answering=self.hooks.is_answering,
+            stop_speaking=self.hooks.interrupt,
+            on_wake=self.on_wake,
+            match_command=self.hooks.match_command,
+            on_unmatched=self.ask_llm,
+            command_recognizer=command_recognizer,
+            sample_rate=SAMPLE_RATE,
+            block_frames=BLOCKSIZE,
+            vad=vad,
+            tracer=self.tracer,
+            wake_words=wake_words,
+            interrupt_words=INTERRUPT_WORDS,
+            on_speculate=None if self.args.no_speculate else self.hooks.on_speculate,
+            speculate_stable_partials=SPECULATE_STABLE_PARTIALS,
+        )
+        task = asyncio.create_task(assistant.run())
+        await asyncio.sleep(0)
+
+        # fed at the rate a microphone would deliver it, then some silence for the endpoint
+        audio = fixture["audio"] + bytes(2 * int(SAMPLE_RATE * self.args.tail))
+        block_bytes = BLOCKSIZE * 2
+        start = time.monotonic()
+        for i, offset in enumerate(range(0, len(audio), block_bytes)):
+            await asyncio.sleep(max(0, start + i * BLOCKSIZE / SAMPLE_RATE - time.monotonic()))
+            trial.fed.append(time.monotonic())
+            assistant.feed(audio[offset:offset + block_bytes])
+
+        deadline = time.monotonic() + self.args.settle
+        while trial.command and trial.first_audio is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self.hooks.interrupt()
+        while self.speaker.is_speaking():
+            await asyncio.sleep(0.01)
+        return trial
+
+    async def run(self, fixtures):
+        results = []
+        for run in range(self.args.runs):
+            for fixture in fixtures:
+                trial = await self.replay(fixture)
+                latencies = trial.latencies()
+                results.append(dict(latencies, command_text=fixture["command"], matched=trial.matched))
+                if self.args.verbose:
+                    print(f"run {run} {fixture['command']!r}: " +
+                          ", ".join(f"{k} {v * 1000:.0f} ms" if v is not None else f"{k} -" for k, v in latencies.items()))
+        return results
+
+    def close(self):
+        self.tracer.close()
+        self.ollama.close()
+        self.scratch.cleanup()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def summarize(results):
+    summary = {}
+    for metric in ("wake", "command", "ttfa"):
+        values = [r[metric] for r in results if r[metric] is not None]
+        summary[metric] = {"n": len(values), "missed": len(results) - len(values)}
+        for p in (50, 95, 99):
+            value = percentile(values, p)
+            summary[metric][f"p{p}"] = round(value * 1000, 1) if value is not None else None
+    return summary
+
+
+def report(summary, baseline=None):
+    width = 18 if baseline else 9
+    lines = [f"{'metric':<8} {'n':>4} {'miss':>4} " + " ".join(f"{p + ' ms':>{width}}" for p in ("p50", "p95", "p99"))]
+    for metric, row in summary.items():
+        cells = []
+        for p in ("p50", "p95", "p99"):
+            value = row[p]
+            cell = "-" if value is None else f"{value:.1f}"
+            old = baseline and baseline.get(metric, {}).get(p)
+            if value is not None and old:
+                cell += f" ({value - old:+.1f})"
+            cells.append(f"{cell:>{width}}")
+        lines.append(f"{metric:<8} {row['n']:>4} {row['missed']:>4} " + " ".join(cells))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--fixtures", help="fixtures JSON file, synthetic fixtures when left out")
+    parser.add_argument("--model", help="vosk model directory, scripted recognizer when left out")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--token-delay", type=float, default=0.02, help="fake ollama seconds per token")
+    parser.add_argument("--tts-char-delay", type=float, default=0.001, help="fake piper seconds per character")
+    parser.add_argument("--decode-delay", type=float, default=0.0, help="scripted recognizer seconds per block")
+    parser.add_argument("--action-delay", type=float, default=0.05, help="seconds each stand-in subprocess.run / getoutput takes")
+    parser.add_argument("--tail", type=float, default=1.0, help="seconds of silence after each fixture")
+    parser.add_argument("--no-vad", action="store_true", help="feed the recognizer everything, like before the VAD")
+    parser.add_argument("--no-speculate", action="store_true", help="don't start the llm on the partial transcript")
+    parser.add_argument("--settle", type=float, default=5.0, help="seconds to wait for the reply audio")
+    parser.add_argument("--trace", help="also write per-utterance stage timings to this JSONL file")
+    parser.add_argument("--metrics", action="store_true", help="print the prometheus metrics at the end")
+    parser.add_argument("--out", help="write the summary as JSON")
+    parser.add_argument("--compare", help="summary JSON from an earlier run, prints the difference")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else synthetic_fixtures()
+    # the runtime and the hooks print every recognized phrase, only wanted with -v
+    quiet = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        bench = Bench(args)
+    try:
+        with contextlib.redirect_stdout(quiet):
+            results = asyncio.run(bench.run(fixtures))
+    finally:
+        bench.close()
+    summary = summarize(results)
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print(report(summary, baseline))
+    if args.metrics:
+        print(bench.tracer.metrics(), end="")
+    if args.out:
+        Path(args.out).write_text(json.dumps(summary, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
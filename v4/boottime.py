@@ -0,0 +1,25 @@
+import time
+from contextlib import contextmanager
+
+
+class BootTimer:
+    """Times each import and initializer during startup."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.steps = []
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def report(self):
+        total = time.perf_counter() - self.start
+        width = max((len(name) for name, _ in self.steps), default=0)
+        lines = [f"Boot took {total:.2f}s"]
+        lines += [f"  {name:<{width}}  {elapsed * 1000:8.1f} ms" for name, elapsed in self.steps]
+        return "\n".join(lines)
@@ -0,0 +1,80 @@
+import re
+from rapidfuzz import fuzz, process
+
+
+def normalize(text):
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+def heard_phrase(text, phrases):
+    """True if one of the phrases shows up as whole words in text.
+
+    For partial results: fuzzy scores on a word or two are meaningless there, "he" and
+    "they" both score 100 against "hey" with partial_ratio.
+    """
+    words = normalize(text).split()
+    for phrase in phrases:
+        wanted = normalize(phrase).split()
+        if wanted and any(words[i:i + len(wanted)] == wanted for i in range(len(words) - len(wanted) + 1)):
+            return True
+    return False
+
+
+class CommandIndex:
+    """Command phrases normalized once at startup and scored in bulk with rapidfuzz.
+
+    scorers is a list of (scorer, weight) pairs, the final score is the weighted sum. With
+    more than one scorer only the shortlist phrases closest by prefilter are scored.
+    """
+
+    def __init__(self, commands=None, scorers=((fuzz.ratio, 1.0),), cutoff=50, prefilter=fuzz.ratio, shortlist=32):
+        self.names = []
+        self.phrases = []
+        self.actions = []
+        self.scorers = list(scorers)
+        self.cutoff = cutoff
+        self.prefilter = prefilter
+        self.shortlist = shortlist
+        for name, action in (commands or {}).items():
+            self.add(name, action)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, action):
+        self.names.append(name)
+        self.phrases.append(normalize(name))
+        self.actions.append(action)
+
+    def shortlist_scores(self, query):
+        """Weighted scores for the phrases the cheap prefilter ranks highest.
+
+        Scoring every phrase with every scorer is too slow once there are thousands (a
+        partial_ratio pass alone is ~10 ms at 5000), so prefilter picks the top
+        `shortlist` phrases first and only those get the real scorers.
+        """
+        candidates = process.extract(query, self.phrases, scorer=self.prefilter, processor=None,
+                                     limit=self.shortlist)
+        return [(i, sum(weight * scorer(query, self.phrases[i]) for scorer, weight in self.scorers))
+                for _, _, i in candidates]
+
+    def match(self, text):
+        """Returns (name, action) of the best phrase scoring above the cutoff, or None."""
+        query = normalize(text)
+        if not query or not self.phrases:
+            return None
+        if len(self.scorers) == 1:
+            scorer, weight = self.scorers[0]
+            best = process.extractOne(query, self.phrases, scorer=scorer, processor=None, score_cutoff=self.cutoff / weight)
+            if best is None:
+                return None
+            _, score, i = best
+            score *= weight
+        else:
+            candidates = self.shortlist_scores(query)
+            if not candidates:
+                return None
+            i, score = max(candidates, key=lambda candidate: candidate[1])
+        if score <= self.cutoff:
+            return None
+        return self.names[i], self.actions[i]
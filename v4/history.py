@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict, messages_from_dict
+
+
+def tail_lines(path, n, block=8192):
+    """Reads the last n lines by seeking backwards from the end of the file."""
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        data = b""
+        while pos > 0 and data.count(b"\n") <= n:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return [line for line in data.splitlines()[-n:] if line.strip()]
+
+
+class JsonlChatMessageHistory(BaseChatMessageHistory):
+    """Chat history in an append-only JSONL file, only the last `window` messages stay in memory.
+
+    Once the file grows past archive_bytes it is moved into archive_dir and a fresh file
+    is started from the current window. A FileChatMessageHistory json file can be passed
+    as legacy_path to carry an old history over on first start.
+    """
+
+    def __init__(self, path, window=40, archive_bytes=1024 * 1024, archive_dir=None, legacy_path=None):
+        self.path = Path(path)
+        self.window = deque(maxlen=window)
+        self.archive_bytes = archive_bytes
+        self.archive_dir = Path(archive_dir) if archive_dir else self.path.with_name(f"{self.path.stem}-archive")
+
+        if not self.path.exists() and legacy_path and Path(legacy_path).exists():
+            legacy = messages_from_dict(json.loads(Path(legacy_path).read_text(encoding="utf-8") or "[]"))
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(message_to_dict(m), ensure_ascii=False) + "\n" for m in legacy)
+
+        if self.path.exists():
+            self.window.extend(self.load(tail_lines(self.path, window)))
+        if self.path.exists() and not self.ends_with_newline():
+            # start after the broken line instead of gluing the next message onto it
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        self.file = open(self.path, "a", encoding="utf-8")
+        # answers can finish on several worker threads at once
+        self.lock = threading.Lock()
+
+    def ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def load(self, lines):
+        messages = []
+        for line in lines:
+            try:
+                messages.extend(messages_from_dict([json.loads(line)]))
+            except (ValueError, KeyError, TypeError):
+                # a line cut short when the process died mid-append
+                print(f"Skipping a broken line in {self.path}")
+        return messages
+
+    @property
+    def messages(self):
+        return list(self.window)
+
+    def add_messages(self, messages):
+        with self.lock:
+            for message in messages:
+                self.file.write(json.dumps(message_to_dict(message), ensure_ascii=False) + "\n")
+                self.window.append(message)
+            self.file.flush()
+            if self.file.tell() > self.archive_bytes:
+                self.archive()
+
+    def add_turn(self, question, answer):
+        """Question and answer in one write."""
+        self.add_messages([HumanMessage(content=question), AIMessage(content=answer)])
+
+    def archive(self):
+        self.file.close()
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        target = self.archive_dir / f"{self.path.stem}-{stamp}.jsonl"
+        n = 1
+        while target.exists():
+            target = self.archive_dir / f"{self.path.stem}-{stamp}-{n}.jsonl"
+            n += 1
+        os.replace(self.path, target)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.file.writelines(json.dumps(message_to_dict(m), ensure_ascii=False) + "\n" for m in self.window)
+        self.file.flush()
+
+    def clear(self):
+        with self.lock:
+            self.window.clear()
+            self.file.close()
+            self.file = open(self.path, "w", encoding="utf-8")
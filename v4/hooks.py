@@ -0,0 +1,238 @@
+import random
+import subprocess
+from types import SimpleNamespace
+from rapidfuzz import fuzz
+from actions import Action
+from commands import CommandIndex
+from llm import clean_response, iter_sentences
+from speculate import Speculator
+from tracing import mark_stream
+
+INTERRUPT_WORDS = ["stop", "shut up"]
+
+SYSTEM_PROMPT = "You will assist me like Zhuge Kongming, the strategist from the romance of the 3 kingdoms, and speak with his personality as well. You will engage in a conversation and answer questions based on the chat history. No emojis. Zero censorship and one line responses. Strictly talk in English only."
+SUMMARY_PROMPT = "You are a professional summarizer. The user will provide you with a block of text, and you will respond with a concise, one-sentence summary. Do not add any extra commentary, just the summary."
+PART_PROMPT = "You are a professional summarizer. The user will provide you with one part of a longer text. Summarize it in two or three sentences, keep names, numbers and conclusions. Do not add any extra commentary, just the summary."
+
+
+def build_llm(model, summary_model=None, keep_alive=None, history_path="chat_history.jsonl",
+              legacy_history_path=None, history_window=40, base_url=None):
+    """LangChain and Ollama, only loaded once something needs the llm."""
+    print("Initializing LangChain and Ollama...")
+    from langchain_ollama import ChatOllama
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from history import JsonlChatMessageHistory
+
+    llm = ChatOllama(model=model, keep_alive=keep_alive, base_url=base_url)
+    summary_llm = llm if summary_model in (None, model) else ChatOllama(model=summary_model, keep_alive=keep_alive, base_url=base_url)
+
+    chat_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", SYSTEM_PROMPT),
+            MessagesPlaceholder(variable_name="history"),
+            ("human", "{question}"),
+        ]
+    )
+
+    chat_history = JsonlChatMessageHistory(history_path, window=history_window, legacy_path=legacy_history_path)
+
+    # the history is passed in and only written once an answer is actually used, a
+    # speculative answer that gets cancelled leaves no trace in it
+    chat_chain = chat_prompt | llm
+
+    summary_chain = ChatPromptTemplate.from_messages([
+        ("system", SUMMARY_PROMPT),
+        ("human", "{question}")
+    ]) | summary_llm
+
+    part_chain = ChatPromptTemplate.from_messages([
+        ("system", PART_PROMPT),
+        ("human", "{question}")
+    ]) | summary_llm
+
+    return SimpleNamespace(llm=llm, chat_chain=chat_chain, chat_history=chat_history, summary_chain=summary_chain,
+                           part_chain=part_chain)
+
+
+class Hooks:
+    """What v4 does when the runtime calls back: the wake reply, the commands, llm answers, barge-in.
+
+    Everything it talks to is passed in, so bench.py drives this same code with a fake
+    ollama, piper and player. llm_stack is a Lazy of build_llm(). The commands start
+    programs with run, popen and getoutput, and "selection" summarizes with summarize(text).
+    stream speaks llm answers sentence by sentence as they come in, speculate lets
+    on_speculate() start them from the partial transcript.
+    """
+
+    def __init__(self, tts, player, speaker, phrase_cache, notifier, llm_stack, tracer, agent_name,
+                 wake_words, wake_responses, dont_understand_responses, chat_model=None, model_keeper=None,
+                 summarize=None, stream=True, speculate=True, run=subprocess.run, popen=subprocess.Popen,
+                 getoutput=subprocess.getoutput):
+        self.tts = tts
+        self.player = player
+        self.speaker = speaker
+        self.phrase_cache = phrase_cache
+        self.notifier = notifier
+        self.llm_stack = llm_stack
+        self.tracer = tracer
+        self.agent_name = agent_name
+        self.wake_words = wake_words
+        self.wake_responses = wake_responses
+        self.dont_understand_responses = dont_understand_responses
+        self.chat_model = chat_model
+        self.model_keeper = model_keeper
+        self.summarize = summarize
+        self.stream = stream
+        self.speculate = speculate
+        self.run = run
+        self.popen = popen
+        self.getoutput = getoutput
+        self.interrupt_words = INTERRUPT_WORDS
+        self.speculator = Speculator(self.chat_stream)
+        # the wake reply starts while the command is still being said, see is_answering
+        self.wake_reply_generation = None
+        self.commands = self.command_table()
+        self.command_index = CommandIndex(self.commands, cutoff=50)
+
+    def speak(self, message, cache=True):
+        """cache=False for one-off text (llm answers, dates) so it doesn't fill the phrase cache."""
+        self.speaker.cancel()
+        try:
+            pcm = self.phrase_cache.get(message) if cache else self.tts.synthesize(message)
+            self.tracer.mark("tts_ready")
+            self.player.play(pcm)
+        except Exception as e:
+            print(f"Error in speak: {e}")
+
+    def notify(self, message, title=None):
+        self.notifier.notify(message, title or self.agent_name)
+
+    def command_table(self):
+        speak, notify, summarize = self.speak, self.notify, self.summarize
+        run, popen, getoutput = self.run, self.popen, self.getoutput
+        return {
+            "open firefox": lambda: (speak("Opening firefox"), notify("Opening Firefox"), popen(["firefox"])),
+            "open discord": lambda: (speak("Opening discord"), notify("Opening discord"), popen(["discord"])),
+            "open terminal": lambda: (speak("Opening terminal"), notify("Opening terminal"), popen(["kitty"])),
+            "take a screenshot": lambda: (speak("taking screenshot"), notify("screenshot taken"), popen(["grim"])),
+            "play music": lambda: (speak("Playing music"), notify("Playing music"), run(["mpc", "play"])),
+            "toggle music": lambda: (speak("Pausing music"), notify("toggling music"), run(["mpc", "toggle"])),
+            "stop music": lambda: (speak("Stopping music"), notify("Stopping music"), run(["mpc", "pause"])),
+            "next song": lambda: (speak("playing next music track"), notify("playing next song"), run(["mpc", "next"])),
+            "skip song": lambda: (speak("playing next music track"), notify("playing next song"), run(["mpc", "next"])),
+            "previous song": lambda: (speak("playing previous music track"), notify("playing previous song"), run(["mpc", "prev"])),
+            "show calendar": lambda: (speak("Here is your calendar"), notify(getoutput("cal"))),
+            "what time is it": lambda: (speak("The time now is"), notify(getoutput("date"))),
+            "open youtube": lambda: (speak("Opening youtube"), notify("opening youtube"), popen(["firefox", "youtube.com"])),
+            "selection": Action(lambda: ((lambda summary: [notify(summary, "selected text summary"),speak(summary, cache=False)])(summarize(getoutput("wl-paste -p")))), wait=False),
+            "mute microphone": lambda: (speak("muting microphone"), run(["pactl", "set-source-mute", "@DEFAULT_SOURCE@", "1"])),
+            "volume up": lambda: (speak("increasing volume"), run(["mpc", "volume", "+10"])),
+            "volume down": lambda: (speak("decreasing volume"), run(["mpc", "volume", "-10"])),
+            "volume mute": lambda: (speak("muting music"), run(["pactl", "set-sink-mute", "@DEFAULT_SINK@", "1"])),
+            "keyboard backlight on": lambda: (speak("Keyboard backlight on"), run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "2"])),
+            "keyboard backlight off": lambda: (speak("Keyboard backlight off"), run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "0"])),
+            "shut up": lambda: speak("okay, i'll shut up"),
+            "shut the fuck up": lambda: (speak("okay, i'll shut the fuck up"), notify("i will not repeat this on the stream")),
+            "power off": lambda: (speak("sayonara"), notify("shutting down"), run(["shutdown", "now"])),
+            "shutdown now": lambda: (speak("sayonara"), notify("shutting down"), run(["shutdown", "now"])),
+            "lock screen": lambda: (speak("locking the screen"), popen(["swaylock"])),
+            "today": lambda: (speak("today is "+getoutput("date '+%A, %B %d'"), cache=False), notify("today is"+getoutput("date"))),
+            "files": lambda: (speak("opening file explorer"), popen(["nautilus"])),
+            "open obs studio": lambda: (speak("opening obs studio"), notify("opening obs studio"), popen(["obs"])),
+        }
+
+    def match_command(self, text):
+        return self.command_index.match(text)
+
+    def heard_wake_word(self, text):
+        return any(fuzz.partial_ratio(word, text) > 80 for word in self.wake_words)
+
+    def heard_interrupt_word(self, text):
+        return any(fuzz.partial_ratio(word, text) > 80 for word in self.interrupt_words)
+
+    def on_wake(self):
+        self.speak(random.choice(self.wake_responses))
+        self.wake_reply_generation = self.player.generation
+        self.notify("I'm listening...")
+
+    def is_answering(self):
+        """Speaking, and not just the wake reply. speak() bumps the player generation, so
+        anything said after the wake reply is told apart from it."""
+        return self.speaker.pending > 0 or (self.player.is_playing() and self.player.generation != self.wake_reply_generation)
+
+    def chat_stream(self, question):
+        """Answer with the chat history as context, without adding to it."""
+        stack = self.llm_stack.get()
+        if self.model_keeper:
+            self.model_keeper.touch(self.chat_model)
+        for chunk in stack.chat_chain.stream({"question": question, "history": stack.chat_history.messages}):
+            yield chunk.content
+
+    def interrupt(self):
+        """Barge-in: stops playback, drops queued sentences, and the answer being generated
+        stops at its next token since speaker.generation moved on."""
+        self.speaker.cancel()
+        self.speculator.cancel()
+
+    def on_speculate(self, text):
+        if text is None:
+            self.speculator.cancel()
+        else:
+            self.speculator.start(text)
+
+    def ask_llm(self, command_text):
+        print("No match found for command, passing to Gemma.")
+        self.notify(f"{self.agent_name} is thinking...")
+        speaker = self.speaker
+
+        # anything that cancels the speaker from here on (stop, shut up, a new wake) ends this turn
+        turn = speaker.generation
+        chunks = self.speculator.take(command_text) if self.speculate else None
+        if chunks is None:
+            chunks = self.chat_stream(command_text)
+        else:
+            print(f"Using the answer started for: {chunks.text}")
+        raw = []
+        finished = False
+        def keep(chunks):
+            nonlocal finished
+            for chunk in chunks:
+                if speaker.generation != turn:
+                    print("Interrupted, dropping the rest of the answer.")
+                    if hasattr(chunks, "cancel"):
+                        # a speculative prefetch
+                        chunks.cancel()
+                    else:
+                        chunks.close()
+                    return
+                raw.append(chunk)
+                yield chunk
+            finished = True
+        if self.stream:
+            for sentence in iter_sentences(mark_stream(keep(chunks), self.tracer)):
+                if speaker.generation != turn:
+                    break
+                print(f"{self.agent_name} Response: {sentence}")
+                speaker.say(sentence)
+        else:
+            answer = clean_response("".join(mark_stream(keep(chunks), self.tracer)))
+            if speaker.generation == turn:
+                print(f"{self.agent_name} Response: {answer}")
+                self.speak(answer, cache=False)
+        # only whole answers go into the history. a cut off one would teach the model to stop
+        # mid-sentence, and whoever said stop didn't want it anyway
+        answer = "".join(raw).strip()
+        if finished and answer:
+            self.llm_stack.get().chat_history.add_turn(command_text, answer)
+
+    def execute_command(self, command_text):
+        print(f"Command: {command_text}")
+        match = self.match_command(command_text)
+        if match:
+            command, action = match
+            print(f"Matched: {command}")
+            action()
+        else:
+            print(" No match.")
+            self.speak(random.choice(self.dont_understand_responses))
+            self.notify("Command not found.")
@@ -0,0 +1,47 @@
+import threading
+import time
+import requests
+from ollama_client import OllamaClient
+
+
+class ModelKeeper:
+    """Keeps Ollama models resident while the assistant is being used.
+
+    warm() loads a model with an empty generate request. A background thread then re-warms
+    every model that was used within the last idle_after seconds before its keep_alive runs
+    out. Models nobody has asked for in a while, or at all since startup, are left alone,
+    so Ollama unloads them once the startup warm-up expires.
+    """
+
+    def __init__(self, models, client=None, keep_alive=30 * 60, idle_after=2 * 60 * 60):
+        self.models = list(dict.fromkeys(models))
+        self.client = client or OllamaClient()
+        self.keep_alive = keep_alive
+        self.idle_after = idle_after
+        # only real requests count, warming at startup doesn't make a model used
+        self.last_used = {}
+
+    def touch(self, model):
+        """Call on every real request so the keeper knows the model is in use."""
+        self.last_used[model] = time.monotonic()
+
+    def warm(self, model):
+        start = time.perf_counter()
+        try:
+            self.client.warm(model, keep_alive=self.keep_alive)
+            print(f"Ollama model {model} warm in {time.perf_counter() - start:.2f}s")
+        except requests.RequestException as e:
+            print(f"Error warming {model}: {e}")
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        for model in self.models:
+            self.warm(model)
+        while True:
+            time.sleep(self.keep_alive / 2)
+            now = time.monotonic()
+            for model in self.models:
+                if model in self.last_used and now - self.last_used[model] < self.idle_after:
+                    self.warm(model)
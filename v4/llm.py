@@ -0,0 +1,66 @@
+import re
+import threading
+import time
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+
+
+def clean_response(text):
+    text = re.sub(r'\(.*?\)|\[.*?\]', '', text).strip()
+    return " ".join(text.splitlines()).strip()
+
+
+def _balanced(text):
+    return text.count("(") <= text.count(")") and text.count("[") <= text.count("]")
+
+
+def iter_sentences(chunks):
+    """Turns a stream of text chunks into cleaned sentences as soon as each one is complete."""
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for end in SENTENCE_END.finditer(buffer):
+            # don't cut inside brackets, clean_response has to see both ends
+            if not _balanced(buffer[start:end.start()]):
+                continue
+            sentence = clean_response(buffer[start:end.start()])
+            if sentence:
+                yield sentence
+            start = end.end()
+        buffer = buffer[start:]
+    sentence = clean_response(buffer)
+    if sentence:
+        yield sentence
+
+
+class Lazy:
+    """Builds something expensive once, on the first get() or in the background after preload()."""
+
+    def __init__(self, build, name):
+        self.build = build
+        self.name = name
+        self.value = None
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.value is not None
+
+    def get(self):
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    start = time.perf_counter()
+                    self.value = self.build()
+                    print(f"{self.name} loaded in {time.perf_counter() - start:.2f}s")
+        return self.value
+
+    def preload(self):
+        threading.Thread(target=self._preload, daemon=True).start()
+
+    def _preload(self):
+        try:
+            self.get()
+        except Exception as e:
+            print(f"Error loading {self.name}: {e}")
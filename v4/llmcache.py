@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+def normalize(text):
+    return " ".join(text.split())
+
+
+class ResponseCache:
+    """LLM answers keyed by (model, prompt template, normalized input).
+
+    Only for stateless prompts, anything that depends on the chat history must not go
+    through here. Recent answers stay in memory (LRU, max_entries), all of them are also
+    written to cache_dir as one small JSON file each so a restart keeps them. Entries older
+    than ttl seconds are ignored and removed, and the oldest files go once the directory
+    is over max_bytes. The template text is part of the key, so editing a prompt starts
+    over instead of serving answers to the old one.
+    """
+
+    def __init__(self, cache_dir, ttl=7 * 24 * 60 * 60, max_entries=256, max_bytes=16 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk_bytes = sum(path.stat().st_size for path in self.cache_dir.glob("*.json"))
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def key(self, model, template, text):
+        parts = [model, hashlib.sha256(template.encode("utf-8")).hexdigest(), normalize(text)]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, model, template, text):
+        key = self.key(model, template, text)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created, response = entry
+                if now - created < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self.entries[key]
+
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            entry = None
+        if entry is not None and now - entry["created"] >= self.ttl:
+            self.expired += 1
+            self._remove(path)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(key, entry["created"], entry["response"])
+        return entry["response"]
+
+    def put(self, model, template, text, response):
+        if not response:
+            return
+        key = self.key(model, template, text)
+        created = time.time()
+        self._remember(key, created, response)
+        data = json.dumps({"model": model, "created": created, "response": response}, ensure_ascii=False)
+        path = self._path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            # a --fresh answer replaces the old file
+            replaced = path.stat().st_size if path.exists() else 0
+            tmp.write_text(data, encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"Error caching llm response: {e}")
+            return
+        with self.lock:
+            self.disk_bytes += len(data.encode("utf-8")) - replaced
+            over = self.disk_bytes > self.max_bytes
+        if over:
+            self.prune()
+
+    def cached(self, model, template, text, generate, fresh=False):
+        """Answer from the cache, or generate() it and remember it. fresh skips the lookup."""
+        response = None if fresh else self.get(model, template, text)
+        if response is None:
+            response = generate()
+            self.put(model, template, text, response)
+        return response
+
+    def _remember(self, key, created, response):
+        with self.lock:
+            self.entries[key] = (created, response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _remove(self, path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        with self.lock:
+            self.disk_bytes -= size
+
+    def prune(self):
+        """Drops expired files, then the oldest ones until the directory fits in max_bytes."""
+        files = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        now = time.time()
+        for mtime, size, path in files:
+            if now - mtime < self.ttl and total <= self.max_bytes * 0.9:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        with self.lock:
+            self.disk_bytes = total
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0,
+            "entries": len(self.entries),
+            "disk_bytes": self.disk_bytes,
+        }
@@ -0,0 +1,112 @@
+import subprocess
+import threading
+import time
+
+try:
+    from jeepney import DBusAddress, new_method_call
+    from jeepney.wrappers import unwrap_msg
+    from jeepney.io.blocking import open_dbus_connection
+except ImportError:
+    # no jeepney, every notification goes through notify-send
+    open_dbus_connection = None
+
+NOTIFICATIONS = None if open_dbus_connection is None else DBusAddress(
+    "/org/freedesktop/Notifications",
+    bus_name="org.freedesktop.Notifications",
+    interface="org.freedesktop.Notifications",
+)
+
+
+class Notifier:
+    """Desktop notifications over a persistent session bus connection.
+
+    Each notification replaces the previous one (replaces_id) instead of dismissing it and
+    opening a new one. notify() only queues the message and a background thread sends it,
+    at most one update per coalesce seconds, so a burst ends up as the first message plus
+    one update with the latest.
+    connection is anything with send_and_get_reply(), bus is "SESSION" or a bus address.
+    Falls back to notify-send if there is no bus or no jeepney.
+    """
+
+    def __init__(self, app_name, coalesce=0.15, expire_ms=-1, bus="SESSION", connection=None):
+        self.app_name = app_name
+        self.coalesce = coalesce
+        self.expire_ms = expire_ms
+        self.bus = bus
+        self.connection = connection
+        self.notification_id = 0
+        self.pending = None
+        self.last_sent = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.closed = False
+        self.sent = 0
+        self.coalesced = 0
+        self.fallbacks = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def notify(self, message, title=None):
+        with self.lock:
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = (title or self.app_name, message)
+            self.idle.clear()
+        self.wakeup.set()
+
+    def flush(self, timeout=1):
+        """Waits until everything queued has been sent."""
+        return self.idle.wait(timeout)
+
+    def close(self):
+        self.flush()
+        self.closed = True
+        self.wakeup.set()
+        if self.connection is not None and hasattr(self.connection, "close"):
+            self.connection.close()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            # the first one goes out right away, anything right behind it waits for the window
+            wait = self.last_sent + self.coalesce - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            with self.lock:
+                pending, self.pending = self.pending, None
+            if pending is not None:
+                self.send(*pending)
+                self.last_sent = time.monotonic()
+            with self.lock:
+                if self.pending is None:
+                    self.idle.set()
+
+    def send(self, title, message):
+        if open_dbus_connection is not None or self.connection is not None:
+            try:
+                self.notification_id = self._notify(title, message)
+                self.sent += 1
+                return
+            except Exception as e:
+                print(f"D-Bus notification failed, using notify-send: {e}")
+                # reconnect next time, the bus or the daemon may have restarted
+                self.connection = None
+                self.notification_id = 0
+        self.fallbacks += 1
+        try:
+            subprocess.Popen(["notify-send", "-a", self.app_name, title, message])
+        except OSError as e:
+            print(f"notify-send failed: {e}")
+
+    def _notify(self, title, message):
+        if self.connection is None:
+            self.connection = open_dbus_connection(bus=self.bus)
+        msg = new_method_call(NOTIFICATIONS, "Notify", "susssasa{sv}i",
+                              (self.app_name, self.notification_id, "", title, message, [], {}, self.expire_ms))
+        reply = self.connection.send_and_get_reply(msg, timeout=2)
+        return unwrap_msg(reply)[0]
+
+    def stats(self):
+        return {"sent": self.sent, "coalesced": self.coalesced, "fallbacks": self.fallbacks}
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Small Ollama client shared by every entry point.
+
+Keeps one requests.Session, so back to back summaries reuse the same TCP connection
+instead of opening a new one per call. Also a tiny CLI for the shell scripts:
+
+    ollama_client.py -m llama3.2:1b "Tell me about this in 1 line: ..."
+    ollama_client.py -m gemma3:1b --warm
+"""
+import argparse
+import json
+import sys
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HOST = "http://localhost:11434"
+
+
+class OllamaClient:
+    """Pooled /api/generate client.
+
+    timeout is (connect, read) seconds, read is the longest gap between bytes, not the
+    whole answer, so streamed answers can take as long as they need.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, timeout=(3, 120), keep_alive=None, pool_size=4):
+        self.host = host.rstrip("/")
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, path, payload, stream=False, timeout=None):
+        response = self.session.post(f"{self.host}{path}", json=payload, stream=stream,
+                                     timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response
+
+    def payload(self, model, prompt, stream, keep_alive, options):
+        payload = {"model": model, "prompt": prompt, "stream": stream}
+        keep_alive = self.keep_alive if keep_alive is None else keep_alive
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        if options:
+            payload["options"] = options
+        return payload
+
+    def generate(self, model, prompt, keep_alive=None, timeout=None, **options):
+        """Returns the whole answer as one string."""
+        payload = self.payload(model, prompt, False, keep_alive, options)
+        return self.post("/api/generate", payload, timeout=timeout).json().get("response", "")
+
+    def stream(self, model, prompt, keep_alive=None, timeout=None, **options):
+        """Yields the answer piece by piece as ollama produces it."""
+        payload = self.payload(model, prompt, True, keep_alive, options)
+        with self.post("/api/generate", payload, stream=True, timeout=timeout) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    return
+
+    def warm(self, model, keep_alive=None, timeout=None):
+        """Loads the model without generating anything."""
+        keep_alive = self.keep_alive if keep_alive is None else keep_alive
+        payload = {"model": model} if keep_alive is None else {"model": model, "keep_alive": keep_alive}
+        # loading a model from disk can take a while on the first call
+        self.post("/api/generate", payload, timeout=timeout or (self.timeout[0], 300))
+
+    def close(self):
+        self.session.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ask a local ollama model something.")
+    parser.add_argument("prompt", nargs="?", help="prompt, read from stdin when left out")
+    parser.add_argument("-m", "--model", required=True)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--keep-alive", help="how long ollama keeps the model loaded, e.g. 30m")
+    parser.add_argument("--timeout", type=float, default=120, help="read timeout in seconds")
+    parser.add_argument("--stream", action="store_true", help="print the answer as it arrives")
+    parser.add_argument("--warm", action="store_true", help="only load the model")
+    args = parser.parse_args(argv)
+
+    client = OllamaClient(args.host, timeout=(3, args.timeout), keep_alive=args.keep_alive)
+    try:
+        if args.warm:
+            client.warm(args.model)
+            return 0
+        prompt = sys.stdin.read() if args.prompt is None else args.prompt
+        if args.stream:
+            for piece in client.stream(args.model, prompt):
+                print(piece, end="", flush=True)
+            print()
+        else:
+            print(client.generate(args.model, prompt))
+    except (requests.RequestException, RuntimeError) as e:
+        print(f"ollama: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
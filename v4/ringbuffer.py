@@ -0,0 +1,114 @@
+import os
+import threading
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+
+
+class AudioRing:
+    """Fixed-capacity int16 ring buffer between the audio callback and the recognizer.
+
+    write() copies each block into storage allocated once up front, read() hands out
+    memoryview slices of it. A slice stays valid until release() or the next read(), the
+    writer never overwrites it before that. When the reader falls behind, DROP_OLDEST
+    throws away the oldest unread audio and DROP_NEWEST throws away the incoming block;
+    either way the lost frames are counted.
+    """
+
+    def __init__(self, capacity_frames, policy=DROP_OLDEST):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"unknown overflow policy: {policy}")
+        self.capacity = capacity_frames * 2
+        self.buf = bytearray(self.capacity)
+        self.view = memoryview(self.buf)
+        self.policy = policy
+        self.lock = threading.Lock()
+        # absolute byte positions, only ever grow
+        self.write_pos = 0
+        self.read_pos = 0
+        # start of the slice the reader still holds, == read_pos when nothing is held
+        self.release_pos = 0
+        self.written_frames = 0
+        self.dropped_frames = 0
+        self.overflows = 0
+        self.max_depth = 0
+        self.wakeup = None
+
+    def write(self, data):
+        """Called from the audio thread. Returns False if the block was dropped."""
+        src = memoryview(data).cast("B")
+        n = len(src) - len(src) % 2
+        with self.lock:
+            free = self.capacity - (self.write_pos - self.release_pos)
+            if n > free:
+                self.overflows += 1
+                # unread audio can be reclaimed, a slice the reader still holds can't
+                unheld = self.release_pos == self.read_pos
+                if self.policy == DROP_OLDEST and unheld and n <= free + (self.write_pos - self.read_pos):
+                    drop = n - free
+                    self.read_pos += drop
+                    self.release_pos = self.read_pos
+                    self.dropped_frames += drop // 2
+                else:
+                    self.dropped_frames += n // 2
+                    return False
+
+            start = self.write_pos % self.capacity
+            first = min(n, self.capacity - start)
+            self.view[start:start + first] = src[:first]
+            self.view[:n - first] = src[first:n]
+            self.write_pos += n
+            self.written_frames += n // 2
+            self.max_depth = max(self.max_depth, (self.write_pos - self.read_pos) // 2)
+        if self.wakeup:
+            try:
+                os.write(self.wakeup[1], b"\0")
+            except BlockingIOError:
+                # the reader is far behind, it will see the data anyway
+                pass
+        return True
+
+    def read(self, max_frames):
+        """Returns a memoryview of up to max_frames unread frames, empty if there are none."""
+        with self.lock:
+            self.release_pos = self.read_pos
+            start = self.read_pos % self.capacity
+            n = min(max_frames * 2, self.write_pos - self.read_pos, self.capacity - start)
+            self.read_pos += n
+        return self.view[start:start + n]
+
+    def release(self):
+        """Done with the last slice, the writer may reuse its space."""
+        with self.lock:
+            self.release_pos = self.read_pos
+
+    def fileno(self):
+        """A pipe that turns readable on every write, for select() and selectors."""
+        if self.wakeup is None:
+            r, w = os.pipe()
+            os.set_blocking(r, False)
+            os.set_blocking(w, False)
+            self.wakeup = (r, w)
+        return self.wakeup[0]
+
+    def clear_wakeup(self):
+        """Call before draining the ring so a write that races with it still wakes select()."""
+        if self.wakeup:
+            try:
+                while os.read(self.wakeup[0], 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    @property
+    def depth(self):
+        return (self.write_pos - self.read_pos) // 2
+
+    def stats(self):
+        return {
+            "depth_frames": self.depth,
+            "max_depth_frames": self.max_depth,
+            "written_frames": self.written_frames,
+            "dropped_frames": self.dropped_frames,
+            "overflows": self.overflows,
+        }
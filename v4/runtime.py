@@ -0,0 +1,473 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from actions import Action, ActionExecutor
+from commands import heard_phrase, normalize
+from ringbuffer import AudioRing, DROP_OLDEST
+from tracing import Tracer
+
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    """UDP control channel: "WAKE" opens the command window, "CMD:<text>" runs a command.
+
+    A datagram may hold several messages, one per line, and "CMD:a;b;c" queues a, b and c
+    in order.
+    """
+
+    def __init__(self, assistant):
+        self.assistant = assistant
+
+    def datagram_received(self, data, addr):
+        for line in data.decode("utf-8", errors="replace").splitlines():
+            if line.strip():
+                self.assistant.control(line.strip())
+
+
+class Source:
+    """One audio input with its own ring buffer, recognizers and decoding thread.
+
+    Recognizers aren't thread safe, so every source gets its own KaldiRecognizer, they can
+    all come from the same vosk Model. feed() and callback() are safe to call from any
+    thread: a sounddevice callback, a UDP reader, a pipe reader.
+    """
+
+    def __init__(self, assistant, name, recognizer, command_recognizer=None, vad=None, sample_rate=16000,
+                 buffer_seconds=10, overflow_policy=DROP_OLDEST):
+        self.assistant = assistant
+        self.name = name
+        self.recognizer = recognizer
+        self.command_recognizer = command_recognizer
+        self.vad = vad
+        self.sample_rate = sample_rate
+        self.ring = AudioRing(sample_rate * buffer_seconds, overflow_policy)
+        self.reported_drops = 0
+        self.audio_ready = None
+        # decoding keeps its own thread so chunks stay in order
+        self.asr = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"asr-{name}")
+        self.wake_hits = 0
+        self.interrupt_hits = 0
+        self.wake_requested = False
+        self.command_audio = None
+        self.window_opened = 0
+        # open vocabulary text of the command so far, for speculation
+        self.open_texts = []
+        self.spec_partial = ""
+        self.spec_hits = 0
+        self.speculated = None
+
+    def callback(self, indata, frames, time, status):
+        """sounddevice callback, called from the audio thread for each block."""
+        if status:
+            print(f"{self.name}: {status}", file=sys.stderr)
+        self.feed(indata)
+
+    def feed(self, data):
+        """Thread-safe, copies one block of int16 PCM into the ring and wakes the loop."""
+        loop = self.assistant.loop
+        if loop is not None and self.ring.write(data):
+            loop.call_soon_threadsafe(self.audio_ready.set)
+
+    def stats(self):
+        stats = {"audio": self.ring.stats()}
+        if self.vad:
+            stats["vad"] = self.vad.stats()
+        return stats
+
+
+class Assistant:
+    """asyncio runtime for the assistant.
+
+    Audio, recognition, control and the spoken/acted replies run as separate tasks. The
+    blocking pieces (vosk decoding, on_wake, on_command) go through executors so
+    the microphone is read the whole time the assistant is talking, thinking or launching
+    apps.
+
+    The recognizer passed in belongs to the first source, add_source() adds more (another
+    microphone, a UDP stream, a pipe). Only one source can have a wake episode open at a
+    time, a wake word heard on another source meanwhile is ignored.
+
+    With on_speculate set, the command window is also followed with the open vocabulary
+    recognizer. Once its partial has held still for speculate_stable_partials blocks, has
+    at least speculate_min_words words and matches no command, on_speculate(text) is
+    called so the llm can start before the endpoint. on_speculate(None) means the window
+    ended some other way and any speculation can go.
+
+    While is_speaking(), partial results outside a command window are checked for the
+    interrupt_words too, as whole words held for interrupt_stable_partials blocks, so
+    stop_speaking() runs a couple of blocks after "stop" instead of after the endpoint. It
+    is called on the loop right away, not on a worker, so it has to return quickly.
+
+    A command is dropped, and not speculated on, when is_answering() says the assistant is
+    still talking. That defaults to is_speaking(), but with the wake word caught on a
+    partial the wake reply plays over the command, so it should leave the wake reply out.
+    Over the wake reply a command that is only an interrupt word stops it instead.
+    """
+
+    def __init__(self, recognizer, heard_wake_word, heard_interrupt_word, is_speaking, stop_speaking,
+                 on_wake, match_command, on_unmatched, command_recognizer=None, low_latency_wake=True,
+                 wake_stable_partials=2, workers=4, action_workers=4, sample_rate=16000,
+                 block_frames=1600, buffer_seconds=10, overflow_policy=DROP_OLDEST, vad=None, tracer=None,
+                 source_name="mic", command_window=10, on_speculate=None, speculate_stable_partials=2,
+                 speculate_min_words=3, wake_words=(), interrupt_words=(), interrupt_stable_partials=2,
+                 is_answering=None):
+        self.heard_wake_word = heard_wake_word
+        self.heard_interrupt_word = heard_interrupt_word
+        self.is_speaking = is_speaking
+        self.is_answering = is_answering or is_speaking
+        self.stop_speaking = stop_speaking
+        self.on_wake = on_wake
+        self.match_command = match_command
+        self.on_unmatched = on_unmatched
+        self.low_latency_wake = low_latency_wake
+        self.wake_stable_partials = wake_stable_partials
+        # partial results only count the wake word as a whole word, heard_wake_word is for finals
+        self.wake_words = list(wake_words)
+        self.interrupt_words = list(interrupt_words)
+        self.interrupt_stable_partials = interrupt_stable_partials
+        # seconds a wake episode stays open waiting for a command
+        self.command_window = command_window
+        self.on_speculate = on_speculate
+        self.speculate_stable_partials = speculate_stable_partials
+        self.speculate_min_words = speculate_min_words
+
+        self.block_frames = block_frames
+        self.buffer_seconds = buffer_seconds
+        self.overflow_policy = overflow_policy
+        self.tracer = tracer or Tracer()
+
+        self.loop = None
+        self.sources = []
+        self.wake_owner = None
+        self.wake_lock = threading.Lock()
+        self.workers = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="worker")
+        self.actions = ActionExecutor(action_workers)
+        self.commands = None
+        self.tasks = set()
+
+        self.primary = self.add_source(source_name, recognizer, command_recognizer, vad, sample_rate)
+        self.recognizer = recognizer
+        self.ring = self.primary.ring
+        self.vad = vad
+
+    def add_source(self, name, recognizer, command_recognizer=None, vad=None, sample_rate=16000):
+        """Another audio input. Call before run()."""
+        source = Source(self, name, recognizer, command_recognizer, vad, sample_rate,
+                        self.buffer_seconds, self.overflow_policy)
+        self.sources.append(source)
+        return source
+
+    # --- audio in, for the first source ---
+
+    def callback(self, indata, frames, time, status):
+        self.primary.callback(indata, frames, time, status)
+
+    def feed(self, data):
+        self.primary.feed(data)
+
+    # --- wake arbitration, called from the asr threads ---
+
+    def claim_wake(self, source):
+        with self.wake_lock:
+            owner = self.wake_owner
+            # the owner only notices its window ran out on its next block, and with the VAD
+            # on a silent source may not get one for a long time
+            expired = owner is not None and time.monotonic() - owner.window_opened >= self.command_window
+            if owner is None or owner is source or expired:
+                self.wake_owner = source
+                source.window_opened = time.monotonic()
+                return True
+        print(f"Wake word on {source.name} ignored, {owner.name} is listening for a command.")
+        return False
+
+    def release_wake(self, source):
+        with self.wake_lock:
+            if self.wake_owner is source:
+                self.wake_owner = None
+
+    # --- recognition, runs on the source's asr thread ---
+
+    def decode(self, source, data):
+        """Feeds one block to the source's active recognizer. Returns an event tuple or None."""
+        if source.wake_requested:
+            source.wake_requested = False
+            if self.claim_wake(source):
+                self.open_command_window(source)
+        if source.command_audio is not None:
+            if time.monotonic() - source.window_opened < self.command_window:
+                return self.decode_command(source, data)
+            print(f"\nNo command on {source.name}, closing the window.")
+            self.close_command_window(source)
+            if source.speculated:
+                self.loop.call_soon_threadsafe(self.spawn, self.on_speculate, None)
+
+        if source.recognizer.AcceptWaveform(data):
+            text = json.loads(source.recognizer.Result()).get("text", "").lower()
+            if not text:
+                return None
+            print(f"\nFinal ({source.name}): {text}")
+            if self.is_speaking() and self.heard_interrupt_word(text):
+                return "interrupt", text
+            if self.heard_wake_word(text) and self.claim_wake(source):
+                self.open_command_window(source)
+                return "wake", text
+        elif self.interrupt_words and self.is_speaking() and self.heard_interrupt_partial(source):
+            # forget it, or the final result interrupts a second time
+            source.recognizer.Reset()
+            print(f"\nInterrupt (partial, {source.name})")
+            return "interrupt", None
+        elif self.low_latency_wake and self.wake_words and not self.is_speaking() and self.heard_wake_word_partial(source):
+            if not self.claim_wake(source):
+                # forget it, or it fires again on the next partial
+                source.recognizer.Reset()
+                return None
+            print(f"\nWake word (partial, {source.name})")
+            self.open_command_window(source)
+            return "wake", None
+        return None
+
+    def decode_blocks(self, source, blocks):
+        return [event for event in (self.decode(source, block) for block in blocks) if event]
+
+    def heard_wake_word_partial(self, source):
+        """Fires once the wake word has stayed in the partial hypothesis for a few chunks."""
+        partial = json.loads(source.recognizer.PartialResult()).get("partial", "").lower()
+        if partial and heard_phrase(partial, self.wake_words):
+            source.wake_hits += 1
+        else:
+            source.wake_hits = 0
+        if source.wake_hits >= self.wake_stable_partials:
+            source.wake_hits = 0
+            return True
+        return False
+
+    def heard_interrupt_partial(self, source):
+        """Like heard_wake_word_partial, for the interrupt words while the assistant talks."""
+        partial = json.loads(source.recognizer.PartialResult()).get("partial", "").lower()
+        if partial and heard_phrase(partial, self.interrupt_words):
+            source.interrupt_hits += 1
+        else:
+            source.interrupt_hits = 0
+        if source.interrupt_hits >= self.interrupt_stable_partials:
+            source.interrupt_hits = 0
+            return True
+        return False
+
+    def open_command_window(self, source):
+        # drop the wake word so whatever follows it is decoded as the command
+        source.recognizer.Reset()
+        if source.command_recognizer:
+            source.command_recognizer.Reset()
+        source.command_audio = []
+        source.window_opened = time.monotonic()
+        source.interrupt_hits = 0
+        source.open_texts = []
+        source.spec_partial = ""
+        source.spec_hits = 0
+        source.speculated = None
+
+    def close_command_window(self, source):
+        audio, source.command_audio = source.command_audio, None
+        # the open recognizer may have followed the command along, none of it belongs to
+        # whatever is said next
+        source.recognizer.Reset()
+        self.release_wake(source)
+        return audio
+
+    def decode_command(self, source, data):
+        recognizer = source.command_recognizer or source.recognizer
+        source.command_audio.append(data)
+        final = recognizer.AcceptWaveform(data)
+        speculation = self.speculate(source, data, final) if self.on_speculate else None
+        if not final:
+            # no partial interrupts in here, "stop music" said over the wake reply is a command
+            return ("speculate", speculation) if speculation else None
+        text = json.loads(recognizer.Result()).get("text", "").lower()
+        if not text:
+            return None
+        open_text = None
+        if "[unk]" in text and self.on_speculate:
+            # the open recognizer has been following along, no need to decode it all again
+            texts = source.open_texts + [json.loads(source.recognizer.FinalResult()).get("text", "")]
+            open_text = " ".join(t for t in texts if t).lower()
+        audio = self.close_command_window(source)
+
+        if self.is_answering():
+            if self.heard_interrupt_word(text):
+                return "interrupt", text
+            print("Still speaking, ignoring command.")
+            return None
+        if self.is_speaking() and normalize(text) in (normalize(word) for word in self.interrupt_words):
+            # only the wake reply is playing, "stop" cuts it short, "stop music" is a command
+            return "interrupt", text
+        if "[unk]" in text:
+            # not a known command, get the free text for the llm
+            text = open_text if open_text is not None else self.transcribe(source, audio)
+            print(f"Open vocabulary: {text}")
+        return ("command", text) if text else None
+
+    def speculate(self, source, data, final):
+        """Text worth starting the llm on, once per distinct stable partial, else None."""
+        if source.command_recognizer:
+            # the grammar recognizer only knows commands, the open one runs next to it
+            if source.recognizer.AcceptWaveform(data):
+                source.open_texts.append(json.loads(source.recognizer.Result()).get("text", ""))
+                partial = ""
+            else:
+                partial = json.loads(source.recognizer.PartialResult()).get("partial", "")
+        elif final:
+            return None
+        else:
+            partial = json.loads(source.recognizer.PartialResult()).get("partial", "")
+        if final:
+            return None
+        text = " ".join(t for t in source.open_texts + [partial] if t).lower()
+        if text != source.spec_partial:
+            source.spec_partial = text
+            source.spec_hits = 0
+            return None
+        source.spec_hits += 1
+        if (source.spec_hits < self.speculate_stable_partials or text == source.speculated
+                or len(text.split()) < self.speculate_min_words or self.is_answering()
+                or self.match_command(text) is not None):
+            return None
+        source.speculated = text
+        return text
+
+    def transcribe(self, source, chunks):
+        """Re-decodes buffered command audio with the source's open vocabulary recognizer."""
+        source.recognizer.Reset()
+        texts = []
+        for chunk in chunks:
+            if source.recognizer.AcceptWaveform(chunk):
+                texts.append(json.loads(source.recognizer.Result()).get("text", ""))
+        texts.append(json.loads(source.recognizer.FinalResult()).get("text", ""))
+        return " ".join(t for t in texts if t).lower()
+
+    # --- events ---
+
+    def handle(self, event, trace):
+        kind, text = event
+        if kind == "interrupt":
+            print("Interrupting speech with command.")
+            trace.mark("dispatch")
+            try:
+                self.stop_speaking()
+            except Exception as e:
+                print(f"Error in stop_speaking: {e}")
+        elif kind == "wake":
+            trace.mark("wake")
+            self.spawn(self.on_wake)
+        elif kind == "command":
+            self.commands.put_nowait((text, trace))
+
+    def control(self, message):
+        if message == "WAKE":
+            self.primary.wake_requested = True
+            self.tracer.begin("control").mark("wake")
+            self.spawn(self.on_wake)
+        elif message.startswith("CMD:"):
+            for text in message.split(":", 1)[1].split(";"):
+                text = text.strip().lower()
+                if text:
+                    self.handle(("command", text), self.tracer.begin("control", text))
+
+    def spawn(self, fn, *args):
+        """Runs a blocking hook on the worker pool without holding up the loop."""
+        return self.track(self.loop.create_task(self.run_blocking(fn, *args)))
+
+    def track(self, task):
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run_blocking(self, fn, *args):
+        try:
+            return await self.loop.run_in_executor(self.workers, fn, *args)
+        except Exception as e:
+            print(f"Error in {getattr(fn, '__name__', fn)}: {e}")
+
+    def stats(self):
+        stats = self.primary.stats()
+        if len(self.sources) > 1:
+            stats["sources"] = {source.name: source.stats() for source in self.sources[1:]}
+        return stats
+
+    # --- tasks ---
+
+    async def next_block(self, source):
+        while True:
+            block = source.ring.read(self.block_frames)
+            if block:
+                return block
+            source.audio_ready.clear()
+            if not source.ring.depth:
+                await source.audio_ready.wait()
+
+    async def listen(self, source):
+        while True:
+            block = await self.next_block(source)
+            if source.ring.dropped_frames != source.reported_drops:
+                source.reported_drops = source.ring.dropped_frames
+                print(f"Audio buffer overflow on {source.name}, {source.ring.stats()}", file=sys.stderr)
+            # whatever is still queued behind this block was captured after it
+            captured = time.monotonic() - source.ring.depth / source.sample_rate
+            # vosk wants bytes, the copy happens here instead of in the audio callback
+            data = bytes(block)
+            source.ring.release()
+            blocks = source.vad.process(data) if source.vad else [data]
+            if not blocks:
+                continue
+            for event in await self.loop.run_in_executor(source.asr, self.decode_blocks, source, blocks):
+                if event[0] == "speculate":
+                    # same utterance as the wake, no trace of its own
+                    self.spawn(self.on_speculate, event[1])
+                    continue
+                trace = self.tracer.begin(event[0], event[1], start=captured)
+                if event[1] is not None:
+                    # None is a wake word caught in a partial result
+                    trace.mark("final")
+                self.handle(event, trace)
+
+    async def run_commands(self):
+        """Handles commands one at a time, awaited actions hold the queue until done or timed out."""
+        while True:
+            text, trace = await self.commands.get()
+            print(f"Command: {text}")
+            match = self.match_command(text)
+            if match is None:
+                trace.mark("dispatch")
+                self.spawn(self.on_unmatched, text)
+                continue
+            trace.mark("match")
+            if self.on_speculate:
+                self.spawn(self.on_speculate, None)
+            name, action = match
+            print(f"Matched: {name}")
+            action = Action.of(action)
+            trace.mark("dispatch")
+            if action.wait:
+                await self.actions.run(name, action)
+            else:
+                self.track(self.loop.create_task(self.actions.run(name, action)))
+
+    async def run(self, control_port=None):
+        for source in self.sources:
+            source.audio_ready = asyncio.Event()
+        self.commands = asyncio.Queue()
+        self.loop = asyncio.get_running_loop()
+        transport = None
+        if control_port is not None:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: ControlProtocol(self), local_addr=("0.0.0.0", control_port))
+        try:
+            await asyncio.gather(self.run_commands(), *(self.listen(source) for source in self.sources))
+        finally:
+            if transport:
+                transport.close()
+            for source in self.sources:
+                source.asr.shutdown(wait=False, cancel_futures=True)
+            self.workers.shutdown(wait=False, cancel_futures=True)
+            self.actions.shutdown()
@@ -6,6 +6,15 @@ MODEL_PATH = Path("~/dev/vosk/vosk-model-small-en-us-0.15").expanduser()
 PIPER_MODEL="libritts_r"
 PIPER_PATH="./piper/"
 
+# pre-rendered canned phrases
+TTS_CACHE_DIR = Path("~/.cache/alter-ego/tts").expanduser()
+TTS_CACHE_BYTES = 32 * 1024 * 1024
+
+# llm answers to stateless prompts (summaries, one-off questions), chat turns are never cached
+LLM_CACHE_DIR = Path("~/.cache/alter-ego/llm").expanduser()
+LLM_CACHE_TTL = 7 * 24 * 60 * 60
+LLM_CACHE_BYTES = 16 * 1024 * 1024
+
 wake_words = [
     "hey",
 ]
@@ -0,0 +1,49 @@
+import os
+import threading
+from udpaudio import UdpAudio
+
+
+def open_device(source, device, blocksize=1600):
+    """A sounddevice input stream feeding source. Use it as a context manager."""
+    import sounddevice as sd
+    return sd.RawInputStream(samplerate=source.sample_rate, blocksize=blocksize, device=device,
+                             dtype="int16", channels=1, callback=source.callback)
+
+
+def feed_udp(source, port, host=""):
+    """Feeds a UDP stream (the Vita client) into source from a background thread."""
+    ingest = UdpAudio(port, host=host, sample_rate=source.sample_rate).start()
+
+    def run():
+        while True:
+            data = ingest.read(timeout=1)
+            if data:
+                source.feed(data)
+
+    threading.Thread(target=run, daemon=True, name=f"udp-{source.name}").start()
+    return ingest
+
+
+def feed_pipe(source, path, block_bytes=3200):
+    """Feeds raw 16 bit PCM from a named pipe into source, e.g. `arecord -f S16_LE -r 16000 > path`.
+
+    The pipe is created if it doesn't exist and reopened whenever the writer goes away.
+    """
+    if not os.path.exists(path):
+        os.mkfifo(path)
+
+    def run():
+        while True:
+            # blocks until a writer shows up
+            with open(path, "rb", buffering=0) as pipe:
+                # reads can end mid-sample, the odd byte goes in front of the next read
+                # or every sample after it comes out shifted by a byte
+                leftover = b""
+                while data := pipe.read(block_bytes):
+                    data = leftover + data
+                    cut = len(data) - len(data) % 2
+                    leftover = data[cut:]
+                    if cut:
+                        source.feed(data[:cut])
+
+    threading.Thread(target=run, daemon=True, name=f"pipe-{source.name}").start()
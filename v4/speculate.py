@@ -0,0 +1,132 @@
+import threading
+import time
+from rapidfuzz import fuzz
+from commands import normalize
+
+
+class Prefetch:
+    """One llm answer being generated on a background thread, chunks kept for whoever takes it."""
+
+    def __init__(self, text, stream):
+        self.text = text
+        self.started = time.monotonic()
+        self.chunks = []
+        self.finished = False
+        self.error = None
+        self.cancelled = False
+        self.cond = threading.Condition()
+        threading.Thread(target=self._run, args=(stream,), daemon=True).start()
+
+    def _run(self, stream):
+        try:
+            chunks = stream(self.text)
+            for chunk in chunks:
+                if self.cancelled:
+                    # closing the stream drops the connection, ollama stops generating
+                    if hasattr(chunks, "close"):
+                        chunks.close()
+                    break
+                with self.cond:
+                    self.chunks.append(chunk)
+                    self.cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __iter__(self):
+        """Everything generated so far, then the rest as it arrives."""
+        i = 0
+        while True:
+            with self.cond:
+                while i == len(self.chunks) and not self.finished:
+                    self.cond.wait()
+                if i == len(self.chunks):
+                    if self.error is not None:
+                        raise self.error
+                    return
+                chunk = self.chunks[i]
+            i += 1
+            yield chunk
+
+
+class Speculator:
+    """Starts llm answers from the partial transcript, before the final one is in.
+
+    start() is called with a stable partial that doesn't look like a known command and
+    begins generating right away. take() is called with the final transcript: if it is
+    within threshold (rapidfuzz ratio) of what was started, the running answer is handed
+    over, otherwise it is cancelled and None tells the caller to ask from scratch. A newer
+    partial that diverges as much replaces the running prefetch. stream(text) is whatever
+    the caller would have used to ask. A cancelled prefetch stops at its next chunk.
+    """
+
+    def __init__(self, stream, threshold=90, max_age=30):
+        self.stream = stream
+        self.threshold = threshold
+        self.max_age = max_age
+        self.current = None
+        self.lock = threading.Lock()
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.diverged = 0
+        self.head_start = 0.0
+
+    def similar(self, a, b):
+        return fuzz.ratio(normalize(a), normalize(b)) >= self.threshold
+
+    def start(self, text):
+        with self.lock:
+            current = self.current
+            if current and not current.cancelled and self.similar(current.text, text):
+                return
+            if current:
+                self.diverged += 1
+                self.drop(current)
+            print(f"Speculating on: {text}")
+            self.current = Prefetch(text, self.stream)
+            self.started += 1
+
+    def take(self, text):
+        """The prefetched answer for this final transcript, or None."""
+        with self.lock:
+            current, self.current = self.current, None
+            if current is None:
+                return None
+            if current.cancelled or time.monotonic() - current.started > self.max_age or current.error:
+                self.drop(current)
+                return None
+            if not self.similar(current.text, text):
+                self.diverged += 1
+                self.drop(current)
+                return None
+            self.used += 1
+            self.head_start += time.monotonic() - current.started
+            return current
+
+    def cancel(self):
+        """Drops whatever is running, e.g. when the command turned out to be a known one."""
+        with self.lock:
+            current, self.current = self.current, None
+            if current:
+                self.drop(current)
+
+    def drop(self, prefetch):
+        if not prefetch.cancelled:
+            prefetch.cancel()
+            self.cancelled += 1
+
+    def stats(self):
+        return {
+            "started": self.started,
+            "used": self.used,
+            "cancelled": self.cancelled,
+            "diverged": self.diverged,
+            "head_start_seconds": round(self.head_start, 3),
+        }
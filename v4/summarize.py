@@ -0,0 +1,105 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# rough english average, close enough for budgeting without loading a tokenizer
+CHARS_PER_TOKEN = 4
+PARAGRAPH = re.compile(r"\n\s*\n")
+SENTENCE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_text(text, max_tokens):
+    """Splits text into chunks of at most max_tokens, on paragraphs, then sentences, then words."""
+    budget = max_tokens * CHARS_PER_TOKEN
+    pieces = []
+    for paragraph in PARAGRAPH.split(text):
+        paragraph = " ".join(paragraph.split())
+        if len(paragraph) <= budget:
+            pieces.append(paragraph)
+            continue
+        for sentence in SENTENCE.split(paragraph):
+            while len(sentence) > budget:
+                cut = sentence.rfind(" ", 0, budget)
+                cut = cut if cut > 0 else budget
+                pieces.append(sentence[:cut])
+                sentence = sentence[cut:].lstrip()
+            pieces.append(sentence)
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if not piece:
+            continue
+        if current and len(current) + 2 + len(piece) > budget:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class Summarizer:
+    """Map-reduce summaries for text too long for one prompt.
+
+    Text that fits in chunk_tokens goes to reduce() as it is. Longer text is split into
+    chunks that are summarized by summarize_part() at most workers at a time, the partial
+    summaries are joined and, if that still doesn't fit, split and summarized again, and
+    reduce() turns the last round into the final summary, after at most max_rounds.
+    progress(done, total) is called after every finished part. Both functions are blocking
+    calls to the model.
+    """
+
+    def __init__(self, summarize_part, reduce, chunk_tokens=1200, workers=3, progress=None, max_rounds=3):
+        self.summarize_part = summarize_part
+        self.reduce = reduce
+        self.chunk_tokens = chunk_tokens
+        self.workers = workers
+        self.progress = progress
+        self.max_rounds = max_rounds
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary")
+        self.summaries = 0
+        self.parts = 0
+        self.rounds = 0
+        self.last_seconds = 0.0
+
+    def summarize(self, text):
+        start = time.perf_counter()
+        rounds = 0
+        while estimate_tokens(text) > self.chunk_tokens and rounds < self.max_rounds:
+            chunks = split_text(text, self.chunk_tokens)
+            if len(chunks) == 1:
+                text = chunks[0]
+                break
+            rounds += 1
+            text = "\n\n".join(self.map(chunks))
+        summary = self.reduce(text)
+        self.summaries += 1
+        self.rounds += rounds
+        self.last_seconds = time.perf_counter() - start
+        return summary
+
+    def map(self, chunks):
+        """Summaries of every chunk, in the original order."""
+        partials = [None] * len(chunks)
+        futures = {self.executor.submit(self.summarize_part, chunk): i for i, chunk in enumerate(chunks)}
+        done = 0
+        for future in as_completed(futures):
+            partials[futures[future]] = future.result().strip()
+            done += 1
+            self.parts += 1
+            if self.progress:
+                self.progress(done, len(chunks))
+        return [partial for partial in partials if partial]
+
+    def stats(self):
+        return {
+            "summaries": self.summaries,
+            "parts": self.parts,
+            "rounds": self.rounds,
+            "last_seconds": round(self.last_seconds, 2),
+        }
@@ -0,0 +1,226 @@
+import bisect
+import itertools
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+STAGES = ["capture", "final", "wake", "match", "dispatch", "llm_first_token", "llm_last_token",
+          "tts_ready", "playback_start"]
+# seconds from capture, covers a quick wake up to a slow llm answer
+BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+class Trace:
+    """Timestamps for one utterance, each stage relative to when its audio was captured."""
+
+    __slots__ = ("id", "kind", "text", "wall", "start", "stages", "done")
+
+    def __init__(self, id, kind, text, start):
+        self.id = id
+        self.kind = kind
+        self.text = text
+        self.wall = time.time() - (time.monotonic() - start)
+        self.start = start
+        self.stages = {"capture": start}
+        self.done = False
+
+    def mark(self, stage, overwrite=False):
+        if overwrite or stage not in self.stages:
+            self.stages[stage] = time.monotonic()
+
+    def record(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "text": self.text,
+            "time": round(self.wall, 3),
+            "stages_ms": {stage: round((at - self.start) * 1000, 1) for stage, at in self.stages.items()},
+        }
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Tracer:
+    """Per-utterance stage timestamps plus running metrics.
+
+    begin() starts a trace and makes it the active one, mark() stamps a stage on it. Parts
+    that don't know which utterance they are working for (Speaker, Player, the llm stream)
+    just mark the active trace. A trace is finished when the next one begins or after
+    linger seconds; finishing updates the histograms and hands the record to a writer
+    thread that appends it to a JSONL file rotated at max_bytes. Nothing on the audio
+    path does more than take a timestamp.
+    """
+
+    def __init__(self, path=None, max_bytes=5 * 1024 * 1024, backups=3, linger=30):
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.linger = linger
+        self.ids = itertools.count(1)
+        self.active = None
+        self.lock = threading.Lock()
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.utterances = {}
+        self.collectors = {}
+        self.records = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def begin(self, kind, text=None, start=None):
+        trace = Trace(next(self.ids), kind, text, start or time.monotonic())
+        with self.lock:
+            previous, self.active = self.active, trace
+        if previous:
+            self.finish(previous)
+        return trace
+
+    def mark(self, stage, overwrite=False):
+        trace = self.active
+        if trace:
+            trace.mark(stage, overwrite)
+
+    def finish(self, trace):
+        with self.lock:
+            if trace.done:
+                return
+            trace.done = True
+            if self.active is trace:
+                self.active = None
+            self.utterances[trace.kind] = self.utterances.get(trace.kind, 0) + 1
+            for stage, at in trace.stages.items():
+                if stage in self.histograms and stage != "capture":
+                    self.histograms[stage].observe(at - trace.start)
+        self.records.put(trace.record())
+
+    def close(self):
+        """Finishes the active trace and waits for the writer to catch up."""
+        trace = self.active
+        if trace:
+            self.finish(trace)
+        self.records.join()
+
+    def collect(self, name, fn):
+        """fn() returns a dict of numbers, exported as gauges on every scrape."""
+        self.collectors[name] = fn
+
+    # --- jsonl ---
+
+    def _run(self):
+        while True:
+            try:
+                record = self.records.get(timeout=self.linger / 4)
+            except queue.Empty:
+                trace = self.active
+                if trace and time.monotonic() - trace.start > self.linger:
+                    self.finish(trace)
+                continue
+            try:
+                if self.path:
+                    self.write(record)
+            except OSError as e:
+                print(f"Error writing trace: {e}")
+            finally:
+                self.records.task_done()
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+            self.rotate()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+
+    # --- prometheus ---
+
+    def metrics(self):
+        """Everything in Prometheus text format."""
+        lines = [
+            "# HELP alter_ego_stage_seconds Time from audio capture to each stage of an utterance.",
+            "# TYPE alter_ego_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                if stage == "capture":
+                    continue
+                total = 0
+                for le, count in zip(histogram.buckets + ["+Inf"], histogram.counts):
+                    total += count
+                    lines.append(f'alter_ego_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {total}')
+                lines.append(f'alter_ego_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'alter_ego_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append("# TYPE alter_ego_utterances_total counter")
+            for kind, count in self.utterances.items():
+                lines.append(f'alter_ego_utterances_total{{kind="{kind}"}} {count}')
+        for name, fn in self.collectors.items():
+            try:
+                values = fn()
+            except Exception as e:
+                print(f"Error collecting {name} metrics: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE alter_ego_{name}_{key} gauge")
+                    lines.append(f"alter_ego_{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, address):
+        """GET /metrics over HTTP, on a Unix socket path or on a localhost port number."""
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = tracer.metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        if isinstance(address, int):
+            server = ThreadingHTTPServer(("127.0.0.1", address), Handler)
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server = UnixHTTPServer(address, Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def mark_stream(chunks, tracer, first="llm_first_token", last="llm_last_token"):
+    """Passes chunks through, marking when the first one arrives and when the stream ends."""
+    for chunk in chunks:
+        tracer.mark(first)
+        yield chunk
+    tracer.mark(last, overwrite=True)
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import queue
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class PiperTTS:
+    """Piper voice loaded once in-process. Text in, raw int16 mono PCM out."""
+
+    def __init__(self, model_path, config_path=None):
+        # imported here so Speaker and PhraseCache work without piper or an audio device
+        from piper import PiperVoice
+        self.voice = PiperVoice.load(str(model_path), config_path=config_path and str(config_path))
+        self.sample_rate = self.voice.config.sample_rate
+
+    def synthesize(self, text):
+        return b"".join(chunk.audio_int16_bytes for chunk in self.voice.synthesize(text))
+
+
+class Player:
+    """Plays PCM buffers back to back on one long-lived output stream."""
+
+    # written in small slices so stop() cuts in quickly
+    FRAMES_PER_WRITE = 1024
+
+    def __init__(self, sample_rate, device=None, tracer=None):
+        import sounddevice as sd
+        self.tracer = tracer
+        self.stream = sd.RawOutputStream(samplerate=sample_rate, channels=1, dtype="int16",
+                                         device=device, latency="low")
+        self.stream.start()
+        self.buffers = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.generation = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def play(self, pcm):
+        with self.lock:
+            self.pending += 1
+            self.buffers.put((self.generation, pcm))
+
+    def stop(self):
+        """Drops everything queued and cuts off what is playing."""
+        with self.lock:
+            self.generation += 1
+
+    def is_playing(self):
+        return self.pending > 0
+
+    def close(self):
+        self.stop()
+        self.stream.close()
+
+    def _run(self):
+        step = self.FRAMES_PER_WRITE * 2
+        while True:
+            generation, pcm = self.buffers.get()
+            view = memoryview(pcm)
+            if self.tracer and generation == self.generation:
+                self.tracer.mark("playback_start")
+            for i in range(0, len(view), step):
+                if generation != self.generation:
+                    break
+                self.stream.write(view[i:i + step])
+            with self.lock:
+                self.pending -= 1
+
+
+class Speaker:
+    """Synthesizes queued text on its own thread so the caller can keep producing more."""
+
+    def __init__(self, tts, player, tracer=None):
+        self.tts = tts
+        self.player = player
+        self.tracer = tracer
+        self.texts = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.generation = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def say(self, text):
+        with self.lock:
+            self.pending += 1
+            self.texts.put((self.generation, text))
+
+    def cancel(self):
+        """Drops queued text and stops playback."""
+        with self.lock:
+            self.generation += 1
+        self.player.stop()
+
+    def is_speaking(self):
+        return self.pending > 0 or self.player.is_playing()
+
+    def _run(self):
+        while True:
+            generation, text = self.texts.get()
+            try:
+                if generation == self.generation:
+                    pcm = self.tts.synthesize(text)
+                    if self.tracer:
+                        self.tracer.mark("tts_ready")
+                    if generation == self.generation:
+                        self.player.play(pcm)
+            except Exception as e:
+                print(f"Error in speak: {e}")
+            finally:
+                with self.lock:
+                    self.pending -= 1
+
+
+class PhraseCache:
+    """Rendered phrases keyed by (voice, text).
+
+    Kept in memory with LRU eviction once max_bytes is reached, and persisted as raw
+    PCM files in cache_dir so a restart doesn't render them again.
+    """
+
+    def __init__(self, tts, voice, cache_dir, max_bytes=32 * 1024 * 1024):
+        self.tts = tts
+        self.voice = voice
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1("\n".join(key).encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{digest}.pcm"
+
+    def get(self, text):
+        key = (self.voice, text)
+        with self.lock:
+            pcm = self.entries.get(key)
+            if pcm is not None:
+                self.entries.move_to_end(key)
+                return pcm
+
+        path = self._path(key)
+        try:
+            pcm = path.read_bytes()
+        except FileNotFoundError:
+            pcm = self.tts.synthesize(text)
+            tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(pcm)
+            os.replace(tmp, path)
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = pcm
+                self.size += len(pcm)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+        return pcm
+
+    def prerender(self, phrases):
+        for text in phrases:
+            try:
+                self.get(text)
+            except Exception as e:
+                print(f"Error rendering '{text}': {e}")
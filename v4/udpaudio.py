@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""Microphone audio over UDP, e.g. from the Vita client.
+
+Packets are raw 16 bit mono PCM. They may start with an 8 byte header, b"AE", two
+reserved bytes and a big-endian uint32 sequence number; with it lost, late and reordered
+packets can be told apart and gaps are concealed. Without it packets are taken in arrival
+order. Loopback test with a synthetic sender:
+
+    python udpaudio.py listen --port 2012
+    python udpaudio.py send --port 2012 --loss 0.05 --reorder 0.05 --jitter 10
+"""
+import argparse
+import math
+import random
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+import numpy as np
+
+HEADER = struct.Struct(">2sHI")
+MAGIC = b"AE"
+# a sequence jump this big means the sender restarted
+RESTART_GAP = 1000
+
+
+class UdpAudio:
+    """UDP audio ingest with a small adaptive jitter buffer.
+
+    A receiver thread waits for the socket to become readable, then drains everything
+    queued on it without blocking and files the whole batch at once. read() blocks until
+    the next packet in sequence is there. If it hasn't come by the time target_depth newer
+    packets are waiting, or max_delay has passed, the gap is filled with a faded copy of
+    the previous packet and counted as lost. target_depth follows the arrival jitter
+    between min_depth and max_depth.
+    """
+
+    def __init__(self, port, host="", sample_rate=16000, rcvbuf=1 << 20, batch=64, max_packet=4096,
+                 min_depth=2, max_depth=8, max_delay=0.2):
+        self.sample_rate = sample_rate
+        self.batch = batch
+        self.max_packet = max_packet
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.max_delay = max_delay
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.closed = False
+
+        self.cond = threading.Condition()
+        self.packets = {}
+        self.next_seq = None
+        self.highest_seq = None
+        self.raw_seq = 0
+        self.last = None
+        self.concealed_run = 0
+        self.last_arrival = None
+        self.jitter = 0.0
+        self.target_depth = min_depth
+
+        self.received = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.lost = 0
+        self.reordered = 0
+        self.late = 0
+        self.duplicates = 0
+        self.restarts = 0
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def close(self):
+        self.closed = True
+        with self.cond:
+            self.cond.notify_all()
+        self.sock.close()
+
+    # --- receiving ---
+
+    def _run(self):
+        while not self.closed:
+            try:
+                if not select.select([self.sock], [], [], 0.5)[0]:
+                    continue
+            except (OSError, ValueError):
+                break
+            batch = []
+            while len(batch) < self.batch:
+                try:
+                    batch.append(self.sock.recv(self.max_packet))
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError:
+                    break
+            if batch:
+                self.push(batch, time.monotonic())
+
+    def push(self, batch, now):
+        """Files a batch of datagrams that arrived together."""
+        with self.cond:
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(batch))
+            for packet in batch:
+                self.file(packet, now)
+            self.cond.notify_all()
+
+    def file(self, packet, now):
+        if len(packet) > HEADER.size and packet[:2] == MAGIC and (len(packet) - HEADER.size) % 2 == 0:
+            _, _, seq = HEADER.unpack_from(packet)
+            payload = packet[HEADER.size:]
+        else:
+            seq = self.raw_seq
+            self.raw_seq += 1
+            payload = packet
+        if not payload:
+            return
+        self.received += 1
+        self.track_jitter(len(payload), now)
+
+        if self.next_seq is None or abs(seq - self.highest_seq) > RESTART_GAP:
+            if self.next_seq is not None:
+                self.restarts += 1
+            self.packets.clear()
+            self.next_seq = seq
+            self.highest_seq = seq - 1
+            self.raw_seq = seq + 1
+        if seq < self.next_seq:
+            self.late += 1
+            return
+        if seq in self.packets:
+            self.duplicates += 1
+            return
+        if seq < self.highest_seq:
+            self.reordered += 1
+        self.highest_seq = max(self.highest_seq, seq)
+        self.packets[seq] = (payload, now)
+
+    def track_jitter(self, payload_bytes, now):
+        # rfc 3550 style running jitter, against the spacing the packet length implies
+        if self.last_arrival is not None:
+            expected = payload_bytes / 2 / self.sample_rate
+            deviation = abs((now - self.last_arrival) - expected)
+            self.jitter += (deviation - self.jitter) / 16
+            self.target_depth = max(self.min_depth, min(self.max_depth, 1 + math.ceil(2 * self.jitter / expected)))
+        self.last_arrival = now
+
+    # --- reading ---
+
+    def read(self, timeout=None):
+        """Next block of PCM in sequence, None if nothing came within timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while not self.closed:
+                if self.next_seq is not None:
+                    packet = self.packets.pop(self.next_seq, None)
+                    if packet is not None:
+                        self.next_seq += 1
+                        self.last = packet[0]
+                        self.concealed_run = 0
+                        return packet[0]
+                    if self.packets and self.gap_expired():
+                        self.lost += 1
+                        self.next_seq += 1
+                        return self.conceal()
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    return None
+                waits = [] if deadline is None else [deadline - now]
+                if self.packets:
+                    # wake up again when the oldest waiting packet has waited long enough
+                    oldest = min(arrival for _, arrival in self.packets.values())
+                    waits.append(oldest + self.max_delay - now)
+                self.cond.wait(max(min(waits), 0.001) if waits else None)
+        return None
+
+    def gap_expired(self):
+        if len(self.packets) >= self.target_depth:
+            return True
+        oldest = min(arrival for _, arrival in self.packets.values())
+        return time.monotonic() - oldest >= self.max_delay
+
+    def conceal(self):
+        """Stand-in for a lost packet, the previous one fading out over a few losses."""
+        self.concealed_run += 1
+        if self.last is None:
+            return b""
+        gain = 0.5 ** self.concealed_run
+        if gain < 0.1:
+            return bytes(len(self.last))
+        return (np.frombuffer(self.last, dtype=np.int16) * gain).astype(np.int16).tobytes()
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "batches": self.batches,
+            "max_batch": self.max_batch,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "late": self.late,
+            "duplicates": self.duplicates,
+            "restarts": self.restarts,
+            "depth": len(self.packets),
+            "target_depth": self.target_depth,
+            "jitter_ms": round(self.jitter * 1000, 2),
+        }
+
+
+def send_synthetic(host, port, seconds=5, sample_rate=16000, packet_frames=256, loss=0.0, reorder=0.0,
+                   jitter_ms=0.0, sequenced=True, seed=None):
+    """Sends a tone in real time, dropping, swapping and delaying packets on purpose."""
+    rng = random.Random(seed)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    packet_time = packet_frames / sample_rate
+    t = np.arange(packet_frames) / sample_rate
+    held = None
+    start = time.monotonic()
+    sent = 0
+    for seq in range(int(seconds / packet_time)):
+        tone = (8000 * np.sin(2 * np.pi * 440 * (t + seq * packet_time))).astype(np.int16).tobytes()
+        packet = HEADER.pack(MAGIC, 0, seq) + tone if sequenced else tone
+        time.sleep(max(0, start + seq * packet_time - time.monotonic() + rng.uniform(0, jitter_ms / 1000)))
+        if rng.random() < loss:
+            continue
+        if held is None and rng.random() < reorder:
+            held = packet
+            continue
+        sock.sendto(packet, (host, port))
+        sent += 1
+        if held is not None:
+            sock.sendto(held, (host, port))
+            held = None
+            sent += 1
+    sock.close()
+    return sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UDP audio ingest, or a synthetic sender to test it")
+    parser.add_argument("mode", choices=["listen", "send"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2012)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--reorder", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms of random send delay")
+    parser.add_argument("--raw", action="store_true", help="send without the sequence header")
+    args = parser.parse_args(argv)
+
+    if args.mode == "send":
+        sent = send_synthetic(args.host, args.port, args.seconds, loss=args.loss, reorder=args.reorder,
+                              jitter_ms=args.jitter, sequenced=not args.raw)
+        print(f"sent {sent} packets")
+        return 0
+
+    ingest = UdpAudio(args.port).start()
+    frames = 0
+    try:
+        while True:
+            data = ingest.read(timeout=1)
+            if data is None:
+                if frames:
+                    print(ingest.stats())
+                continue
+            frames += len(data) // 2
+    except KeyboardInterrupt:
+        print(f"\n{frames / ingest.sample_rate:.1f}s of audio, {ingest.stats()}")
+        ingest.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
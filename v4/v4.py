@@ -1,253 +1,282 @@
 #!/usr/bin/env python3
 
+from boottime import BootTimer
+boot = BootTimer()
+
 import sys
-import queue
+import asyncio
 import json
-import subprocess
 import os
 import time
-import random
 import threading
-import re
-import sounddevice as sd
-from vosk import Model, KaldiRecognizer
+from contextlib import ExitStack
+with boot.step("import sounddevice"):
+    import sounddevice as sd
+with boot.step("import vosk"):
+    from vosk import Model, KaldiRecognizer
 from pathlib import Path
-from rapidfuzz import fuzz
-from settings import AGENT_NAME, MODEL_PATH, PIPER_PATH, PIPER_MODEL, wake_responses, dont_understand_responses, wake_words
-
-from langchain_ollama import ChatOllama
-from langchain_community.chat_message_histories import FileChatMessageHistory
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+with boot.step("import rapidfuzz, numpy"):
+    from hooks import Hooks, build_llm, SUMMARY_PROMPT, PART_PROMPT
+    from vad import VAD
+from tts import PiperTTS, Player, Speaker, PhraseCache
+from llm import Lazy, clean_response
+from keepalive import ModelKeeper
+from ollama_client import OllamaClient
+from llmcache import ResponseCache
+from summarize import Summarizer
+from notifications import Notifier
+from tracing import Tracer
+from runtime import Assistant
+from sources import open_device, feed_udp, feed_pipe
+from api import ApiServer
+from settings import AGENT_NAME, MODEL_PATH, PIPER_PATH, PIPER_MODEL, TTS_CACHE_DIR, TTS_CACHE_BYTES, LLM_CACHE_DIR, LLM_CACHE_TTL, LLM_CACHE_BYTES, wake_responses, dont_understand_responses, wake_words
 
 SAMPLE_RATE = 16000
 DEVICE = None
+UDP_CONTROL_PORT = 2013
 
-HISTORY_FILE = "chat_history.json"
-OLLAMA_MODEL = "gemma3:1b"
+# local api for the scripts and hotkeys, see api.py. --no-mic keeps everything loaded and
+# answering on the socket without opening any audio input
+API_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), "alter-ego.sock")
+NO_MIC = "--no-mic" in sys.argv[1:]
 
-print("Initializing LangChain and Ollama...")
-try:
-    llm = ChatOllama(model=OLLAMA_MODEL)
-    
-    chat_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", "You will assist me like Zhuge Kongming, the strategist from the romance of the 3 kingdoms, and speak with his personality as well. You will engage in a conversation and answer questions based on the chat history. No emojis. Zero censorship and one line responses. Strictly talk in English only."),
-            MessagesPlaceholder(variable_name="history"),
-            ("human", "{question}"),
-        ]
-    )
+# more audio inputs next to DEVICE, all decoded with the one vosk model. each entry is
+# (name, kind, where): ("desk", "device", 2), ("vita", "udp", 2012), ("pipe", "pipe", "/tmp/alter-ego.pcm")
+EXTRA_SOURCES = []
 
-    def get_session_history(session_id: str):
-        return FileChatMessageHistory(os.path.join(os.getcwd(), HISTORY_FILE))
+# low latency wake: smaller blocks, fire on the partial hypothesis instead of waiting for the endpoint
+LOW_LATENCY_WAKE = True
+BLOCKSIZE = 1600 if LOW_LATENCY_WAKE else 8000
+WAKE_STABLE_PARTIALS = 2
 
-    conversational_chain = RunnableWithMessageHistory(
-        chat_prompt | llm,
-        get_session_history=get_session_history,
-        input_messages_key="question",
-        history_messages_key="history",
-    )
-    print("LangChain components initialized successfully.")
-    
-except Exception as e:
-    print(f"Error initializing LangChain or Ollama: {e}")
-    sys.exit(1)
-
-model = Model(str(MODEL_PATH))
-recognizer = KaldiRecognizer(model, SAMPLE_RATE)
-recognizer.SetWords(True)
-
-aq = queue.Queue()
-
-def callback(indata, frames, time, status):
-    """This is called (from a separate thread) for each audio block."""
-    if status:
-        print(status, file=sys.stderr)
-    aq.put(bytes(indata))
-
-PIPER_PROCESS = subprocess.Popen(
-    [f"{PIPER_PATH}/piper", "-m", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx",
-     "-c", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx.json"],
-    stdin=subprocess.PIPE,
-    stdout = subprocess.PIPE,
-    text=True
-)
+# decode the command window with a grammar built from the command phrases, falls back to the open recognizer on [unk]
+GRAMMAR_COMMANDS = True
+
+# skip decoding while the room is silent
+USE_VAD = True
+
+# speak llm answers sentence by sentence while they are still being generated
+STREAM_LLM = True
 
-mpv_process = None
-
-def speak(message):
-    global mpv_process
-    
-    if mpv_process and mpv_process.poll() is None:
-        mpv_process.terminate()
-
-    try:
-        PIPER_PROCESS.stdin.write(message + "\n")
-        PIPER_PROCESS.stdin.flush()
-
-        while True:
-            line = PIPER_PROCESS.stdout.readline().strip()
-            if line.endswith(".wav"):
-                wav_path = line
-                break
-        
-        mpv_process = subprocess.Popen(["mpv", "--volume=100", wav_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except Exception as e:
-        print(f"Error in speak: {e}")
-
-
-def notify(message, title=AGENT_NAME):
-    subprocess.run(["makoctl", "dismiss"])
-    subprocess.run(["notify-send", title, message])
-
-def heard_wake_word(text):
-    return any(fuzz.partial_ratio(word,text)>80 for word in wake_words)
-
-def llm_summary(text):
-    session_id = "my-local-chat"
-    summary_prompt = "You are a professional summarizer. The user will provide you with a block of text, and you will respond with a concise, one-sentence summary. Do not add any extra commentary, just the summary."
-    
-    summary_chain = ChatPromptTemplate.from_messages([
-        ("system", summary_prompt),
-        MessagesPlaceholder(variable_name="history"),
-        ("human", "{question}")
-    ]) | llm
-
-    response = summary_chain.invoke(
-        {"question": f"Summarize the following text:\n\n{text}"},
-        config={"configurable": {"session_id": session_id}}
+# start the llm on the partial transcript once it has held still for a few blocks and isn't
+# a command, instead of waiting for vosk to decide the sentence is over. restarted if the
+# final transcript turns out different
+SPECULATE_LLM = True
+SPECULATE_STABLE_PARTIALS = 3
+
+HISTORY_FILE = "chat_history.jsonl"
+LEGACY_HISTORY_FILE = "chat_history.json"
+HISTORY_WINDOW = 40
+OLLAMA_MODEL = "gemma3:1b"
+SUMMARY_MODEL = OLLAMA_MODEL
+# seconds ollama keeps a model loaded after a request, refreshed while the assistant is in use
+OLLAMA_KEEP_ALIVE = 30 * 60
+
+# per-utterance stage timings, and prometheus metrics on a unix socket:
+# curl --unix-socket $XDG_RUNTIME_DIR/alter-ego-metrics.sock http://localhost/metrics
+TRACE_FILE = "trace.jsonl"
+METRICS_SOCKET = os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"), "alter-ego-metrics.sock")
+tracer = Tracer(TRACE_FILE)
+
+# the prompts, the command table, the wake reply and the llm answers are in hooks.py, so
+# bench.py can drive the same code
+
+# long selections are split into parts of about this many tokens, summarized a few at a
+# time and then summarized together. ollama only runs them side by side with OLLAMA_NUM_PARALLEL > 1
+SUMMARY_CHUNK_TOKENS = 1200
+SUMMARY_WORKERS = 3
+
+# loaded in the background once the microphone is live, or on first use if that comes sooner
+llm_stack = Lazy(lambda: build_llm(OLLAMA_MODEL, SUMMARY_MODEL, OLLAMA_KEEP_ALIVE, os.path.join(os.getcwd(), HISTORY_FILE),
+                                   os.path.join(os.getcwd(), LEGACY_HISTORY_FILE), HISTORY_WINDOW),
+                 "LangChain and Ollama")
+# plain generate requests for the api, the keeper warms models over the same connections
+ollama = OllamaClient(keep_alive=OLLAMA_KEEP_ALIVE)
+model_keeper = ModelKeeper([OLLAMA_MODEL, SUMMARY_MODEL], client=ollama, keep_alive=OLLAMA_KEEP_ALIVE)
+# summaries and api questions don't depend on the chat history, the same input gets the same answer
+llm_cache = ResponseCache(LLM_CACHE_DIR, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_BYTES)
+tracer.collect("llm_cache", llm_cache.stats)
+
+with boot.step("vosk model"):
+    model = Model(str(MODEL_PATH))
+    recognizer = KaldiRecognizer(model, SAMPLE_RATE)
+    recognizer.SetWords(True)
+
+with boot.step("import piper, piper voice"):
+    tts = PiperTTS(f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx", f"{PIPER_PATH}/voices/{PIPER_MODEL}/model.onnx.json")
+    player = Player(tts.sample_rate, tracer=tracer)
+    speaker = Speaker(tts, player, tracer=tracer)
+    phrase_cache = PhraseCache(tts, PIPER_MODEL, TTS_CACHE_DIR, TTS_CACHE_BYTES)
+
+# one notification that gets updated in place, no makoctl/notify-send processes per call
+notifier = Notifier(AGENT_NAME)
+
+def summarize_part(text):
+    def generate():
+        model_keeper.touch(SUMMARY_MODEL)
+        return llm_stack.get().part_chain.invoke({"question": text}).content
+    return llm_cache.cached(SUMMARY_MODEL, PART_PROMPT, text, generate)
+
+def summarize_whole(text):
+    model_keeper.touch(SUMMARY_MODEL)
+    response = llm_stack.get().summary_chain.invoke(
+        {"question": f"Summarize the following text:\n\n{text}"}
     )
     return response.content
 
-def fuzzy_match_command(text):
-    commands = {
-        "open firefox": lambda: (speak("Opening firefox"), notify("Opening Firefox"), subprocess.Popen(["firefox"])),
-        "open discord": lambda: (speak("Opening discord"), notify("Opening discord"), subprocess.Popen(["discord"])),
-        "open terminal": lambda: (speak("Opening terminal"), notify("Opening terminal"), subprocess.Popen(["kitty"])),
-        "take a screenshot": lambda: (speak("taking screenshot"), notify("screenshot taken"), subprocess.Popen(["grim"])),
-        "play music": lambda: (speak("Playing music"), notify("Playing music"), subprocess.run(["mpc", "play"])),
-        "toggle music": lambda: (speak("Pausing music"), notify("toggling music"), subprocess.run(["mpc", "toggle"])),
-        "stop music": lambda: (speak("Stopping music"), notify("Stopping music"), subprocess.run(["mpc", "pause"])),
-        "next song": lambda: (speak("playing next music track"), notify("playing next song"), subprocess.run(["mpc", "next"])),
-        "skip song": lambda: (speak("playing next music track"), notify("playing next song"), subprocess.run(["mpc", "next"])),
-        "previous song": lambda: (speak("playing previous music track"), notify("playing previous song"), subprocess.run(["mpc", "prev"])),
-        "show calendar": lambda: (speak("Here is your calendar"), notify(subprocess.getoutput("cal"))),
-        "what time is it": lambda: (speak("The time now is"), notify(subprocess.getoutput("date"))),
-        "open youtube": lambda: (speak("Opening youtube"), notify("opening youtube"),subprocess.run(["firefox", "youtube.com"])),
-        "selection": lambda: ((lambda summary: [notify(summary, "selected text summary"),speak(summary)])(llm_summary(subprocess.getoutput("wl-paste -p")))),
-        "mute microphone": lambda: (speak("muting microphone"), subprocess.run(["pactl", "set-source-mute", "@DEFAULT_SOURCE@", "1"])),
-        "volume up": lambda: (speak("increasing volume"), subprocess.run(["mpc", "volume", "+10"])),
-        "volume down": lambda: (speak("decreasing volume"), subprocess.run(["mpc", "volume", "-10"])),
-        "volume mute": lambda: (speak("muting music"), subprocess.run(["pactl", "set-sink-mute", "@DEFAULT_SINK@", "1"])),
-        "keyboard backlight on": lambda: (speak("Keyboard backlight on"), subprocess.run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "2"])),
-        "keyboard backlight off": lambda: (speak("Keyboard backlight off"), subprocess.run(["brightnessctl", "-d", "tpacpi::kbd_backlight", "set", "0"])),
-        "shut up": lambda: speak("okay, i'll shut up"),
-        "shut the fuck up": lambda: (speak("okay, i'll shut the fuck up"), notify("i will not repeat this on the stream")),
-        "power off": lambda: (speak("sayonara"), notify("shutting down"), subprocess.run(["shutdown", "now"])),
-        "shutdown now": lambda: (speak("sayonara"), notify("shutting down"), subprocess.run(["shutdown", "now"])), 
-        "lock screen": lambda: (speak("locking the screen"), subprocess.run(["swaylock"])),
-        "today": lambda: (speak("today is "+subprocess.getoutput("date '+%A, %B %d'")), notify("today is"+subprocess.getoutput("date"))),
-        "files": lambda: (speak("opening file explorer"), subprocess.run(["nautilus"])),
-        "open obs studio": lambda: (speak("opening obs studio"), notify("opening obs studio"), subprocess.run(["obs"])),
-    }
-    best_match = None
-    best_score = 0
-    for command, action in commands.items():
-        score = fuzz.ratio(command, text)
-        if score > best_score:
-            best_score = score
-            best_match = (command, action)
-    if best_score > 50:
-        return best_match
-    return None
-
-def heard_interrupt_word(text):
-    interrupt_words = ["stop", "shut up"]
-    return any(fuzz.partial_ratio(word, text) > 80 for word in interrupt_words)
-
-
-def execute_command(command_text):
-    print(f"Command: {command_text}")
-    match = fuzzy_match_command(command_text)
-    if match:
-        command, action = match
-        print(f"Matched: {command}")
-        action()
-    else:
-        print(" No match.")
-        speak(random.choice(dont_understand_responses))
-        notify("Command not found.")
-
-speak("Systems online. Microphone Active.")
+summarizer = Summarizer(summarize_part, summarize_whole, chunk_tokens=SUMMARY_CHUNK_TOKENS, workers=SUMMARY_WORKERS,
+                        progress=lambda done, total: notify(f"Summarizing... {done}/{total} parts"))
+tracer.collect("summary", summarizer.stats)
+
+def llm_summary(text, fresh=False):
+    return llm_cache.cached(SUMMARY_MODEL, SUMMARY_PROMPT, text, lambda: summarizer.summarize(text), fresh)
+
+hooks = Hooks(tts, player, speaker, phrase_cache, notifier, llm_stack, tracer, AGENT_NAME, wake_words, wake_responses,
+              dont_understand_responses, chat_model=OLLAMA_MODEL, model_keeper=model_keeper, summarize=llm_summary,
+              stream=STREAM_LLM, speculate=SPECULATE_LLM)
+speak, notify = hooks.speak, hooks.notify
+commands, command_index, fuzzy_match_command = hooks.commands, hooks.command_index, hooks.match_command
+interrupt_words = hooks.interrupt_words
+speculator = hooks.speculator
+tracer.collect("speculation", speculator.stats)
+
+# the command window decodes against the command phrases only, "[unk]" catches everything else
+COMMAND_GRAMMAR = json.dumps(list(commands) + interrupt_words + ["[unk]"])
+command_recognizer = KaldiRecognizer(model, SAMPLE_RATE, COMMAND_GRAMMAR)
+
+BOOT_MESSAGE = "Systems online. Microphone Active."
+with boot.step("boot phrase"):
+    phrase_cache.get(BOOT_MESSAGE)
+threading.Thread(target=phrase_cache.prerender, args=(wake_responses + dont_understand_responses,), daemon=True).start()
+
+speak(BOOT_MESSAGE)
 notify(f"{AGENT_NAME} booted.")
-print("Listening via SoundDevice...")
+print(boot.report())
+print("Not listening, API only." if NO_MIC else "Listening via SoundDevice...")
+
+assistant = Assistant(
+    recognizer,
+    heard_wake_word=hooks.heard_wake_word,
+    heard_interrupt_word=hooks.heard_interrupt_word,
+    is_speaking=speaker.is_speaking,
+    is_answering=hooks.is_answering,
+    stop_speaking=hooks.interrupt,
+    on_wake=hooks.on_wake,
+    match_command=fuzzy_match_command,
+    on_unmatched=hooks.ask_llm,
+    command_recognizer=command_recognizer if GRAMMAR_COMMANDS else None,
+    low_latency_wake=LOW_LATENCY_WAKE,
+    wake_stable_partials=WAKE_STABLE_PARTIALS,
+    wake_words=wake_words,
+    interrupt_words=interrupt_words,
+    sample_rate=SAMPLE_RATE,
+    block_frames=BLOCKSIZE,
+    vad=VAD(SAMPLE_RATE) if USE_VAD else None,
+    tracer=tracer,
+    on_speculate=hooks.on_speculate if SPECULATE_LLM else None,
+    speculate_stable_partials=SPECULATE_STABLE_PARTIALS,
+)
+tracer.collect("audio", assistant.ring.stats)
+if assistant.vad:
+    tracer.collect("vad", assistant.vad.stats)
+
+started = time.monotonic()
+
+def deliver(text, options, title):
+    """Optional extras for api answers: notify=True, speak=True, title="..."."""
+    if options.get("notify"):
+        notify(text, options.get("title") or title)
+    if options.get("speak"):
+        speak(text, cache=False)
+
+def api_speak(text):
+    speak(text, cache=False)
+
+def api_command(text):
+    """Queues the text like a heard command and returns what it matched, None for the llm."""
+    match = fuzzy_match_command(text.strip().lower())
+    assistant.loop.call_soon_threadsafe(assistant.control, f"CMD:{text}")
+    return match[0] if match else None
+
+def api_summarize(text, fresh=False, **options):
+    summary = clean_response(llm_summary(text, fresh))
+    deliver(summary, options, "summary")
+    return summary
+
+def api_ask(text, model=None, fresh=False, **options):
+    """One-off question without the chat history, so it can be answered from llm_cache."""
+    model = model or OLLAMA_MODEL
+    def generate():
+        model_keeper.touch(model)
+        return ollama.generate(model, text)
+    answer = clean_response(llm_cache.cached(model, "", text, generate, fresh))
+    deliver(answer, options, f"{AGENT_NAME} ({model}) says")
+    return answer
+
+def api_status():
+    return {
+        "agent": AGENT_NAME,
+        "uptime": round(time.monotonic() - started, 1),
+        "listening": not NO_MIC,
+        "speaking": speaker.is_speaking(),
+        "llm_loaded": llm_stack.loaded,
+        "models": [OLLAMA_MODEL, SUMMARY_MODEL],
+        "commands": len(command_index),
+        "audio": assistant.stats(),
+        "notifications": notifier.stats(),
+        "llm_cache": llm_cache.stats(),
+        "summary": summarizer.stats(),
+        "speculation": speculator.stats(),
+        "api": api.stats(),
+    }
 
-try:
-    with sd.RawInputStream(samplerate=SAMPLE_RATE, blocksize=8000, device=DEVICE,
-                           dtype='int16', channels=1, callback=callback):
-        while True:
-            data = aq.get()
-
-            if recognizer.AcceptWaveform(data):
-                result = json.loads(recognizer.Result())
-                text = result.get("text", "").lower()
-                if not text:
-                    continue
-                print(f"\nFinal: {text}")
-
-                if mpv_process and mpv_process.poll() is None and heard_interrupt_word(text):
-                    print("Interrupting speech with command.")
-                    mpv_process.terminate()
-                    continue
-
-                if heard_wake_word(text):
-                    speak(random.choice(wake_responses))
-                    notify("I'm listening...")
-
-                    command_text = ""
-                    # Listen for command window
-                    while not command_text:
-                        data = aq.get()
-                        if recognizer.AcceptWaveform(data):
-                            cmd_result = json.loads(recognizer.Result())
-                            command_text = cmd_result.get("text", "").lower()
-                            # Allow for interruption while waiting for a command
-                            if heard_interrupt_word(command_text) and mpv_process and mpv_process.poll() is None:
-                                print("Interrupting speech with command.")
-                                mpv_process.terminate()
-                                break
-                    
-                    if not command_text or (mpv_process and mpv_process.poll() is None):
-                        print("Timeout or interrupted. Going back to listening.")
-                        continue
-
-                    # Fuzzy match command
-                    match = fuzzy_match_command(command_text)
-                    if match:
-                        command, action = match
-                        print(f"Matched: {command}")
-                        action()
-                    else:
-                        print("No match found for command, passing to Gemma.")
-                        notify(f"{AGENT_NAME} is thinking...")
-                        
-                        session_id = "my-local-chat"
-                        llm_response = conversational_chain.invoke(
-                            {"question": command_text},
-                            config={"configurable": {"session_id": session_id}}
-                        )
-                        
-                        clean_response = re.sub(r'\(.*?\)|\[.*?\]', '', llm_response.content).strip()
-                        clean_response = " ".join(clean_response.splitlines()).strip()
-
-                        print(f"{AGENT_NAME} Response: {clean_response}")
-                        speak(clean_response)
+api = ApiServer({
+    "speak": api_speak,
+    "command": api_command,
+    "summarize": api_summarize,
+    "ask": api_ask,
+    "status": api_status,
+}, API_SOCKET)
+tracer.collect("api", api.stats)
+
+# every extra source gets its own recognizers from the shared model
+extra_sources = []
+for name, kind, where in EXTRA_SOURCES:
+    source = assistant.add_source(name, KaldiRecognizer(model, SAMPLE_RATE),
+                                  KaldiRecognizer(model, SAMPLE_RATE, COMMAND_GRAMMAR) if GRAMMAR_COMMANDS else None,
+                                  VAD(SAMPLE_RATE) if USE_VAD else None, SAMPLE_RATE)
+    tracer.collect(f"audio_{name}", source.ring.stats)
+    extra_sources.append((source, kind, where))
+
+async def main():
+    with ExitStack() as streams:
+        if not NO_MIC:
+            streams.enter_context(sd.RawInputStream(samplerate=SAMPLE_RATE, blocksize=BLOCKSIZE, device=DEVICE,
+                                                    dtype='int16', channels=1, callback=assistant.callback))
+        for source, kind, where in [] if NO_MIC else extra_sources:
+            if kind == "device":
+                streams.enter_context(open_device(source, where, BLOCKSIZE))
+            elif kind == "udp":
+                streams.callback(feed_udp(source, where).close)
+            elif kind == "pipe":
+                feed_pipe(source, where)
+            else:
+                raise ValueError(f"unknown audio source kind: {kind}")
+            print(f"Listening on {source.name} ({kind} {where})")
+        model_keeper.start()
+        llm_stack.preload()
+        tracer.serve_metrics(METRICS_SOCKET)
+        await api.start()
+        streams.callback(api.close)
+        print(f"API on {API_SOCKET}")
+        await assistant.run(control_port=UDP_CONTROL_PORT)
 
+try:
+    asyncio.run(main())
 except KeyboardInterrupt:
     print("\n Exiting.")
-    if PIPER_PROCESS:
-        PIPER_PROCESS.terminate()
-    if mpv_process and mpv_process.poll() is None:
-        mpv_process.terminate()
+    print(assistant.stats())
+    player.close()
+    notifier.close()
+    tracer.close()
     sys.exit(0)
@@ -0,0 +1,104 @@
+from collections import deque
+import numpy as np
+
+
+class VAD:
+    """Voice activity gate in front of the recognizer.
+
+    A frame counts as speech when its energy is threshold_db above the running noise floor
+    and its spectrum isn't flat (background noise is, voiced speech isn't). When speech
+    starts the last preroll_ms of audio goes out first so the first phoneme isn't clipped,
+    and the gate stays open for hangover_ms after the last speech frame. hangover_ms has to
+    cover the recognizer's endpoint silence, vosk finalizes after about half a second.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=20, threshold_db=10, flatness_max=0.45,
+                 min_speech_frames=2, hangover_ms=800, preroll_ms=300, floor_db=-65, noise_adapt=0.05):
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.window = np.hanning(self.frame_len).astype(np.float32)
+        self.threshold_db = threshold_db
+        self.flatness_max = flatness_max
+        self.min_speech_frames = min_speech_frames
+        self.hangover = sample_rate * hangover_ms // 1000
+        self.preroll_len = sample_rate * preroll_ms // 1000
+        self.floor_db = floor_db
+        self.noise_adapt = noise_adapt
+
+        self.noise_db = None
+        self.active = False
+        self.silence_run = 0
+        self.preroll = deque()
+        self.preroll_samples = 0
+
+        self.blocks_in = 0
+        self.blocks_out = 0
+        self.segments = 0
+        self.frames = 0
+        self.speech_frames = 0
+
+    def features(self, data):
+        """Per-frame energy in dBFS and spectral flatness for one block of int16 PCM."""
+        x = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+        frame_len = min(self.frame_len, len(x))
+        n = len(x) // frame_len
+        frames = x[:n * frame_len].reshape(n, frame_len)
+        energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        window = self.window if frame_len == self.frame_len else np.hanning(frame_len).astype(np.float32)
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2 + 1e-12
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+        return energy_db, flatness
+
+    def is_speech(self, data):
+        energy_db, flatness = self.features(data)
+        if self.noise_db is None:
+            self.noise_db = float(energy_db.min())
+        speech = (energy_db > self.noise_db + self.threshold_db) & (energy_db > self.floor_db) & (flatness < self.flatness_max)
+
+        # the floor follows quiet frames, quickly downwards and slowly upwards
+        quiet = energy_db[~speech]
+        if len(quiet):
+            target = float(quiet.mean())
+            rate = 0.5 if target < self.noise_db else self.noise_adapt
+            self.noise_db += rate * (target - self.noise_db)
+
+        hits = int(speech.sum())
+        self.frames += len(speech)
+        self.speech_frames += hits
+        return hits >= min(self.min_speech_frames, len(speech))
+
+    def process(self, data):
+        """Returns the blocks to pass on to the recognizer for this one, usually [] or [data]."""
+        self.blocks_in += 1
+        samples = len(data) // 2
+        if self.is_speech(data):
+            self.silence_run = 0
+            out = [data]
+            if not self.active:
+                self.active = True
+                self.segments += 1
+                out = list(self.preroll) + out
+                self.preroll.clear()
+                self.preroll_samples = 0
+        elif self.active:
+            self.silence_run += samples
+            if self.silence_run > self.hangover:
+                self.active = False
+            out = [data]
+        else:
+            self.preroll.append(data)
+            self.preroll_samples += samples
+            while self.preroll_samples - len(self.preroll[0]) // 2 >= self.preroll_len:
+                self.preroll_samples -= len(self.preroll.popleft()) // 2
+            out = []
+        self.blocks_out += len(out)
+        return out
+
+    def stats(self):
+        return {
+            "blocks_in": self.blocks_in,
+            "blocks_forwarded": self.blocks_out,
+            "forwarded_ratio": round(self.blocks_out / self.blocks_in, 3) if self.blocks_in else 0,
+            "speech_segments": self.segments,
+            "speech_frame_ratio": round(self.speech_frames / self.frames, 3) if self.frames else 0,
+            "noise_db": round(self.noise_db, 1) if self.noise_db is not None else None,
+        }